@@ -5,10 +5,10 @@
 #==============================================================================
 
 PROGRAM = 'at-btmeter.py'
-VERSION = '2.102.181'
+VERSION = '2.107.181'
 CONTACT = 'bright.tiger@mail.com' # michael nagy
 
-import os, sys, time, json, serial
+import os, sys, time, json, struct, selectors, serial
 
 print()
 print("%s %s" % (PROGRAM, VERSION))
@@ -19,6 +19,7 @@ print()
 #==============================================================================
 
 FileName = '.%s.json' % (PROGRAM.split('.')[0])
+SilentWait = 5 # seconds before a meter with no readings is warned of
 
 def ShowHelp():
   HelpText = '''\
@@ -26,15 +27,28 @@ def ShowHelp():
 
 usage:
 
-    %s [-h] [-i=1/2/3/4...] [-f=filename[.json]]
+    %s [-h] [-i=1/2/3/4.../all] [-f=filename[.json]] [-r=filename] [-p=filename]
 
 where:
 
     -h . . . . . . this help text
-    -i=# . . . . . specify multimeter index (default 1)
+    -i=#,# . . . . specify multimeter indexes (default 1), or all
     -f=xxxx  . . . name of output file (default '%s')
+    -r=xxxx  . . . also capture the raw datastream to this file
+    -p=xxxx  . . . replay a raw capture file instead of using a meter
+
+more than one multimeter can be read at once, each giving a channel in the
+output file named for its index (meter1.DC Volt, ...), with their readings
+timestamped on a common clock.  each sample set holds the latest reading
+of every meter, with the "times" they were taken, and recording starts once
+all of them have given one.  a meter that has given none %d seconds after
+the first reading is warned of.
+
+a raw capture keeps the bytes read from the meter, with the time each read
+arrived, so that the capture can be replayed later through the decoder, as
+fast as it will go, to write the dataset again without the meter.
 '''
-  print(HelpText % (sys.argv[0], FileName))
+  print(HelpText % (sys.argv[0], FileName, SilentWait))
   os._exit(1)
 
 #==============================================================================
@@ -61,7 +75,9 @@ def ShowErrorToken(Token):
 # parse arguments
 #==============================================================================
 
-MeterIndex = 1
+MeterIndexes = [1] # or None for all of them
+RawFileName = None
+ReplayFileName = None
 
 Tokens = []
 Depth = 0
@@ -74,8 +90,21 @@ for arg in sys.argv[1:]:
         ShowHelp()
       elif arg.startswith('-i='):
         try:
-          MeterIndex = int(arg[3:])
-        except:
+          if arg[3:] == 'all':
+            MeterIndexes = None
+          else:
+            MeterIndexes = [int(Index) for Index in arg[3:].split(',')]
+            if min(MeterIndexes) < 1 or len(set(MeterIndexes)) < len(MeterIndexes):
+              ShowErrorToken(arg)
+        except ValueError:
+          ShowErrorToken(arg)
+      elif arg.startswith('-r='):
+        RawFileName = arg[3:]
+        if len(RawFileName) < 1:
+          ShowErrorToken(arg)
+      elif arg.startswith('-p='):
+        ReplayFileName = arg[3:]
+        if len(ReplayFileName) < 1:
           ShowErrorToken(arg)
       elif arg.startswith('-f='):
         try:
@@ -95,43 +124,51 @@ for arg in sys.argv[1:]:
 # get access to a specific multimeter
 #==============================================================================
 
-import serial.tools.list_ports
+BaudRate = 2400
+ChunkSize = 14
+ByteTime = 10.0 / BaudRate # start, 8 data and stop bits
 
-Ports = []
+def OpenMeters(MeterIndexes):
+  import serial.tools.list_ports
 
-for Port in list(serial.tools.list_ports.comports()):
-  if "VID:PID=067B:2303" in Port[2]:
-    Ports.append(Port[0])
+  Ports = []
 
-print('  found %d multimeters' % (len(Ports)))
-if not len(Ports):
-  print()
-  print("*** unable to find a multimeter - is one plugged in and turned on?")
-  print()
-  os._exit(1)
+  for Port in list(serial.tools.list_ports.comports()):
+    if "VID:PID=067B:2303" in Port[2]:
+      Ports.append(Port[0])
 
-if len(Ports) < MeterIndex:
-  print()
-  print("*** multimeter index %d out of range" % (MeterIndex))
-  print()
-  os._exit(1)
+  print('  found %d multimeters' % (len(Ports)))
+  if not len(Ports):
+    print()
+    print("*** unable to find a multimeter - is one plugged in and turned on?")
+    print()
+    os._exit(1)
 
-BaudRate = 2400
-ChunkSize = 14
+  if MeterIndexes is None:
+    MeterIndexes = list(range(1, len(Ports) + 1))
 
-try:
-  Meter = serial.Serial(Ports[MeterIndex-1], BaudRate, timeout=1)
-  print('  using multimeter at index %d' % (MeterIndex))
-except serial.serialutil.SerialException:
-  print("*** you don't have permission to use the serial/usb port.  to fix this")
-  print('*** sad state of affairs, first run the following command:')
-  print()
-  print('  sudo usermod -a -G dialout $USER')
-  print()
-  print('*** then log off and back on to make the change effective, and try again.')
-  print()
-  os._exit(1)
+  for MeterIndex in MeterIndexes:
+    if len(Ports) < MeterIndex:
+      print()
+      print("*** multimeter index %d out of range" % (MeterIndex))
+      print()
+      os._exit(1)
 
+  Meters = []
+  try:
+    for MeterIndex in MeterIndexes:
+      Meters.append(serial.Serial(Ports[MeterIndex-1], BaudRate, timeout=1))
+      print('  using multimeter at index %d' % (MeterIndex))
+  except serial.serialutil.SerialException:
+    print("*** you don't have permission to use the serial/usb port.  to fix this")
+    print('*** sad state of affairs, first run the following command:')
+    print()
+    print('  sudo usermod -a -G dialout $USER')
+    print()
+    print('*** then log off and back on to make the change effective, and try again.')
+    print()
+    os._exit(1)
+  return MeterIndexes, Meters
 
 #==============================================================================
 # the following routines decipher the datastream from the meter, which is in
@@ -153,22 +190,11 @@ except serial.serialutil.SerialException:
 # are literal mappings of the 7-segment LCD display segments.
 #==============================================================================
 
-# eliminate redundant leading zeros and negative signs on zero values
-
-def RemoveLeadingZeros(Reading):
-  if Reading.startswith('-'):
-    Normalized = RemoveLeadingZeros(Reading[1:])
-    for Digit in Normalized:
-      if Digit in '123456789':
-        return '-' + Normalized
-    return Normalized
-  while Reading.startswith('0') and len(Reading) > 1:
-    if Reading[1:2] in '0123456789':
-      Reading = Reading[1:]
-    else:
-      break
-  return Reading
-
+# the decoder is driven by lookup tables built once, here, so that a block
+# is decoded in a single pass with no string building, and an unreadable
+# block (a blank or 'L' digit, or an unknown unit) gives None rather than an
+# exception.
+#
 # bitmasks for 7-segment digits:
 #
 #    ---       10
@@ -177,36 +203,18 @@ def RemoveLeadingZeros(Reading):
 #   |   |   40    04
 #    ---       08
 
-def DecodeDigit(Digit):
-  if Digit == 0x00:
-    raise Exception('Digit $%02x' % Digit) # ' '
-  if Digit == 0x68:
-    raise Exception('Digit $%02x' % Digit) # 'L'
-  if Digit == 0x7d:
-    return '0'
-  if Digit == 0x05:
-    return '1'
-  if Digit == 0x5b:
-    return '2'
-  if Digit == 0x1f:
-    return '3'
-  if Digit == 0x27:
-    return '4'
-  if Digit == 0x3e:
-    return '5'
-  if Digit == 0x7e:
-    return '6'
-  if Digit == 0x15:
-    return '7'
-  if Digit == 0x7f:
-    return '8'
-  if Digit == 0x3f:
-    return '9'
-  raise Exception('Digit $%02x' % Digit)
-
-# determine what units to display, and what scale factor to apply, as well
-# as the format to use to display the value.  the flags word is 5 digits,
-# bit-mapped like this:
+Digits = {
+  0x7d: 0, 0x05: 1, 0x5b: 2, 0x1f: 3, 0x27: 4,
+  0x3e: 5, 0x7e: 6, 0x15: 7, 0x7f: 8, 0x3f: 9
+}
+
+# the first nibble tells ac or dc, or neither for the diode and ohm ranges
+
+Classes = {1: '', 3: '', 7: 'DC ', 11: 'AC '}
+
+# the flags nibbles (indices 10-14) tell the units to display, and the scale
+# factor to apply, as well as the format to use to display the value.  they
+# are bit-mapped like this:
 #
 #   80000 u (micro)
 #   20000 K (kilo)
@@ -216,126 +224,302 @@ def DecodeDigit(Digit):
 #   00080 amp
 #   00040 volt
 
-def DecodeFlags(Flags):
-  if   Flags[2:] == '041':
-    Unit = 'Volt'
-    Format = '%5.3f'
-  elif Flags[2:] == '401':
-    Unit = 'Ohm'
-    Format = '%3.1f'
-  elif Flags[2:] == '081':
-    Unit = 'Amp'
-    Format = '%5.3f'
-  else:
-    raise Exception('Unit [%s]' % (Flags[2:]))
-  if   Flags [:2] == '00':
-    Exponent = 0
-  elif Flags [:2] == '02': # M
-    Exponent = 6
-    Format = '%1.0f'
-  elif Flags [:2] == '20': # K
-    Exponent = 3
-    Format = '%1.0f'
-  elif Flags [:2] == '08': # m
-    Exponent = -3
-    Format = '%7.5f'
-  elif Flags [:2] == '80': # u
-    Exponent = -6
-    Format = '%9.7f'
-  else:
-    raise Exception('Exponent [%s]' % (Flags[:2]))
-  return Unit, Exponent, Format
+UnitTable = {
+  0x041: ('Volt', '%5.3f'),
+  0x401: ('Ohm',  '%3.1f'),
+  0x081: ('Amp',  '%5.3f'),
+}
+
+Exponents = {
+  0x00: (0,  None),
+  0x02: (6,  '%1.0f'),   # M
+  0x20: (3,  '%1.0f'),   # K
+  0x08: (-3, '%7.5f'),   # m
+  0x80: (-6, '%9.7f'),   # u
+}
+
+# the whole of a reading's scale, keyed by the class nibble and the flags
+# nibbles together: (unit, multiplier, format)
+
+Scales = {}
+for Class in Classes:
+  for Exponent in Exponents:
+    for Unit in UnitTable:
+      Key = bytes([Class, Exponent >> 4, Exponent & 15, Unit >> 8, (Unit >> 4) & 15, Unit & 15])
+      Scales[Key] = (
+        Classes[Class] + UnitTable[Unit][0], pow(10, Exponents[Exponent][0]),
+        Exponents[Exponent][1] or UnitTable[Unit][1]
+      )
+
+# the digits' positions, with the divisor implied by a decimal point flagged
+# on each of them, and the nibble translations that split a block's bytes
+
+Points = [(3, 1000), (5, 100), (7, 10)]
+Indices = bytes(range(1, ChunkSize + 1))
+HighNibbles = bytes(Byte >> 4 for Byte in range(256))
+LowNibbles = bytes(Byte & 15 for Byte in range(256))
 
 # determine the meter reading, and return the numeric value, the unit, and
-# the best format to display it
-
-def DecodeBuffer(Buffer):
-  for Index, Data in enumerate(Buffer):
-    Check = (Data // 16) - 1
-    if Index != Check:
-      raise Exception('Bad Check Nibble')
-  Image = ''
-  Flags = ''
-  AcDc = ''
-  for Index, Data in enumerate(Buffer):
-    Nibble = Data % 16
-    if Index == 0:
-      if Nibble == 1:
-        pass # Image += 'diode'
-      elif Nibble == 3:
-        pass # Image += 'Ohms'
-      elif Nibble == 7:
-        AcDc = 'DC '
-      elif Nibble == 11: # 'b'
-        AcDc = 'AC '
-      else:
-        raise Exception('Bad Class Nibble [%x]' % (Nibble))
-    elif Index in [1,3,5,7]:
-      if Nibble & 0x08:
-        if Index == 1:
-          Image += '-'
-        else:
-          Image += '.'
-        Nibble &= ~0x08
-      Digit = Nibble * 16
-    elif Index in [2,4,6,8]:
-      Digit += Nibble
-      Image += DecodeDigit(Digit)
-    else:
-      Flags += '%x' % (Nibble)
-  Unit, Exponent, Format = DecodeFlags(Flags)
-  Value = float(RemoveLeadingZeros(Image)) * pow(10,Exponent)
-  Unit = AcDc + Unit
-  return Value, Unit, Format
+# the best format to display it, or None if the block holds no valid reading
+
+def DecodeFrame(Frame):
+  if Frame.translate(HighNibbles) != Indices:
+    return None
+  Low = Frame.translate(LowNibbles)
+  Scale = Scales.get(Low[:1] + Low[9:])
+  if Scale is None:
+    return None
+  Mantissa = 0
+  for Index in (1, 3, 5, 7):
+    Digit = Digits.get(((Low[Index] & 7) << 4) | Low[Index + 1])
+    if Digit is None:
+      return None
+    Mantissa = Mantissa * 10 + Digit
+  Divisor = 1
+  for Index, Point in Points:
+    if Low[Index] & 8:
+      if Divisor > 1:
+        return None # more than one decimal point
+      Divisor = Point
+  if Low[1] & 8 and Mantissa:
+    Mantissa = -Mantissa
+  return Mantissa / Divisor * Scale[1], Scale[0], Scale[2]
+
+# decode many blocks at once, for offline processing, from an iterable of
+# blocks or a bytes object holding consecutive 14-byte blocks
+
+def DecodeFrames(Frames):
+  if isinstance(Frames, (bytes, bytearray)):
+    Frames = [Frames[Offset:Offset + ChunkSize] for Offset in range(0, len(Frames), ChunkSize)]
+  return [DecodeFrame(bytes(Frame)) for Frame in Frames]
 
 #==============================================================================
-# catch the datastream from the meter
+# split the datastream into blocks.  whatever the port has buffered is read in
+# one call, and blocks are framed on the index nibble every byte carries
+# rather than on gaps in the timing: an index of 1 starts a block, each
+# following byte must carry the next index, and a block is complete at 14
+# bytes.  a byte out of sequence abandons the block in progress (counted as
+# dropped) and framing resyncs on the next index of 1.  each block is
+# timestamped with the arrival of its first byte, worked back from the time
+# the read returned by the wire time of the bytes that followed it.  if a raw
+# file is given, every read is also written to it, as it arrived, tagged
+# with the reader's meter number.
 #==============================================================================
 
-print('  waiting for data')
-Time0 = time.time()
-OutputSet = []
-Buffer = b''
-while True:
+class FrameReader:
+  def __init__(self, port, raw=None, meter=0):
+    self.port = port
+    self.raw = raw
+    self.meter = meter
+    self.frame = bytearray()
+    self.stamp = 0.0
+    self.frames = 0
+    self.dropped = 0
+
+  def read(self):
+    """waits for data and returns a list of (time, block) for the blocks it
+    completes"""
+    data = self.port.read(self.port.in_waiting or 1)
+    arrived = time.monotonic()
+    if self.raw and data:
+      WriteRaw(self.raw, self.meter, arrived, data)
+    return self.feed(arrived, data)
+
+  def feed(self, arrived, data):
+    """frames data that arrived at the given time, returning a list of
+    (time, block) for the blocks it completes"""
+    frames = []
+    for offset, byte in enumerate(data):
+      index = byte >> 4
+      if index == 1:
+        if self.frame:
+          self.dropped += 1
+        self.frame = bytearray()
+        self.stamp = arrived - (len(data) - 1 - offset) * ByteTime
+      elif index != len(self.frame) + 1:
+        if self.frame:
+          self.dropped += 1
+          self.frame = bytearray()
+        continue
+      self.frame.append(byte)
+      if len(self.frame) == ChunkSize:
+        frames.append((self.stamp, bytes(self.frame)))
+        self.frames += 1
+        self.frame = bytearray()
+    return frames
+
+#==============================================================================
+# raw capture files hold the bytes read from the meter exactly as they were
+# read, so that a capture can be decoded again later.  after an identifying
+# header, each read is a record of its arrival time (monotonic seconds, a
+# little-endian double), the -i index of the meter it came from (a byte) and
+# its length (an unsigned short), then its bytes.
+#==============================================================================
+
+RawHeader = b'btmeter-raw-1\n'
+RawRecord = struct.Struct('<dBH')
+
+def WriteRaw(File, Meter, Arrived, Data):
+  File.write(RawRecord.pack(Arrived, MeterIndexes[Meter], len(Data)))
+  File.write(Data)
+
+def ReadRaw(RawFileName):
   try:
-    Data = Meter.read()
-    Time1 = time.time()
-    TimeX = Time1 - Time0
-    if TimeX > 0.100:
-      if Buffer:
-        try:
-          Value, Unit, Format = DecodeBuffer(Buffer)
-          if not OutputSet:
-            OutputTime = time.time()
-            OutputUnit = Unit
-            print('  recording data')
-            print()
-          ValueTime = time.time() - OutputTime
-          if OutputUnit == Unit:
-            OutputSet.append({'time': '%5.3f' % (ValueTime), 'values': [Format % (Value)]})
-          print('  %04d  %05.1f  %15.7f %s    \r' % (len(OutputSet), ValueTime, Value, Unit), end='')
-        except KeyboardInterrupt:
-          raise
-        except:
-          #for B in Buffer:
-          #  print(' %02x' % (B), end='')
-          #print()
-          pass
-      Buffer = b''
-    Buffer += Data
-    Time0 = Time1
-  except KeyboardInterrupt:
-    print('\r  ')
-    break
+    with open(RawFileName, 'rb') as File:
+      Raw = File.read()
+  except OSError as Error:
+    ShowError("raw file '%s' could not be read (%s)" % (RawFileName, Error.strerror))
+  if not Raw.startswith(RawHeader):
+    ShowError("'%s' is not a raw btmeter capture" % (RawFileName))
+  Offset = len(RawHeader)
+  while Offset + RawRecord.size <= len(Raw):
+    Arrived, Index, Length = RawRecord.unpack_from(Raw, Offset)
+    Offset += RawRecord.size
+    yield Arrived, Index, Raw[Offset:Offset + Length]
+    Offset += Length
+
+#==============================================================================
+# add a reading from one of the meters to the dataset.  each sample set holds
+# the latest reading of every meter, once all of them have given one, with the
+# time of each, and is stamped with the time of the reading that made it.
+# readings in a different unit from a meter's first one are left out.
+#==============================================================================
+
+OutputSet = []
+Latest = []
+LatestTimes = []
+Units = []
+
+def AddReading(Meter, FrameTime, Value, Unit, Format):
+  if Units[Meter] is None:
+    Units[Meter] = Unit
+  if Units[Meter] != Unit:
+    return False
+  Latest[Meter] = Format % (Value)
+  LatestTimes[Meter] = FrameTime
+  if None in Latest:
+    return False
+  OutputSet.append((FrameTime, list(Latest), list(LatestTimes)))
+  return True
+
+#==============================================================================
+# warn of any meter that has given no reading, which holds up the recording
+#==============================================================================
+
+def ShowSilentMeters():
+  for Meter, Reading in enumerate(Latest):
+    if Reading is None:
+      print('\r*** meter %d has given no readings, and recording waits for every meter' % (
+        MeterIndexes[Meter]
+      ))
+
+#==============================================================================
+# catch the datastreams from the meters, reading whichever has data as it
+# arrives, or replay a raw capture of them through the decoder as fast as it
+# will go
+#==============================================================================
+
+Corrupt = 0
+if ReplayFileName:
+  print("  replaying '%s'" % (ReplayFileName))
+  Readers = {}
+  Start = time.perf_counter()
+  Frames = []
+  for Arrived, Index, Data in ReadRaw(ReplayFileName):
+    Reader = Readers.setdefault(Index, FrameReader(None))
+    Frames += [(FrameTime, Index, Buffer) for FrameTime, Buffer in Reader.feed(Arrived, Data)]
+  Frames.sort(key=lambda Frame: Frame[0])
+  MeterIndexes = sorted(Readers)
+  for Meter, Index in enumerate(MeterIndexes):
+    Readers[Index].meter = Meter
+  Readers = [Readers[Index] for Index in MeterIndexes]
+  Latest = [None] * len(Readers)
+  LatestTimes = [None] * len(Readers)
+  Units = [None] * len(Readers)
+  Readings = DecodeFrames([Buffer for FrameTime, Index, Buffer in Frames])
+  for (FrameTime, Index, Buffer), Reading in zip(Frames, Readings):
+    if Reading is None:
+      Corrupt += 1
+    else:
+      AddReading(MeterIndexes.index(Index), FrameTime, *Reading)
+  Elapsed = time.perf_counter() - Start
+  print('  decoded %d blocks in %1.3f seconds (%1.0f blocks per second)' % (
+    len(Frames), Elapsed, len(Frames) / max(Elapsed, 1e-9)
+  ))
+  print()
+else:
+  MeterIndexes, Meters = OpenMeters(MeterIndexes)
+  Raw = None
+  if RawFileName:
+    Raw = open(RawFileName, 'wb')
+    Raw.write(RawHeader)
+    print("  capturing raw data to '%s'" % (RawFileName))
+  print('  waiting for data')
+  Readers = [FrameReader(Port, Raw, Meter) for Meter, Port in enumerate(Meters)]
+  Latest = [None] * len(Readers)
+  LatestTimes = [None] * len(Readers)
+  Units = [None] * len(Readers)
+  Waiting = None # the time of the first reading, or 0 once silence is warned of
+  Selector = selectors.DefaultSelector()
+  for Reader in Readers:
+    Selector.register(Reader.port, selectors.EVENT_READ, Reader)
+  while True:
+    try:
+      if Waiting and not OutputSet and time.monotonic() - Waiting > SilentWait:
+        ShowSilentMeters()
+        Waiting = 0
+      for Key, Events in Selector.select(timeout=1):
+        Reader = Key.data
+        for FrameTime, Buffer in Reader.read():
+          Reading = DecodeFrame(Buffer)
+          if Reading is None:
+            Corrupt += 1
+            continue
+          if Waiting is None:
+            Waiting = time.monotonic()
+          if AddReading(Reader.meter, FrameTime, *Reading):
+            if len(OutputSet) == 1:
+              print('  recording data')
+              print()
+            print('  %04d  %05.1f  %s    \r' % (len(OutputSet), FrameTime - OutputSet[0][0],
+              '  '.join('%s %s' % Pair for Pair in zip(Latest, Units))), end='')
+    except KeyboardInterrupt:
+      print('\r  ')
+      break
+  if Raw:
+    Raw.close()
+
+for Reader in Readers:
+  Prefix = ''
+  if len(Readers) > 1:
+    Prefix = 'meter %d: ' % (MeterIndexes[Reader.meter])
+  print('  %s%d blocks received, %d dropped while framing' % (
+    Prefix, Reader.frames, Reader.dropped
+  ))
+print('  %d blocks could not be decoded' % (Corrupt))
+if not OutputSet:
+  ShowSilentMeters()
 
 #==============================================================================
-# output the captured data to the json datafile
+# output the captured data to the json datafile, with times from the first
+# sample set
 #==============================================================================
 
+OutputSet.sort(key=lambda Item: Item[0])
+Channels = Units
+if len(Units) > 1:
+  Channels = ['meter%d.%s' % (Index, Unit) for Index, Unit in zip(MeterIndexes, Units)]
+
+def SampleSet(FrameTime, Values, Times):
+  Set = {'time': '%5.3f' % (FrameTime - OutputSet[0][0]), 'values': Values}
+  if len(Times) > 1:
+    Set['times'] = ['%5.3f' % (Time - OutputSet[0][0]) for Time in Times]
+  return Set
+
 with open(FileName, 'w') as f:
   DataSet = {
-    'channels': [OutputUnit],
-    'data'    :  OutputSet
+    'channels': Channels,
+    'data'    : [SampleSet(*Item) for Item in OutputSet]
   }
   f.write(json.dumps(DataSet, indent=2))
 
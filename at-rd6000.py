@@ -7,10 +7,10 @@
 #==============================================================================
 
 PROGRAM = 'at-rd6000.py'
-VERSION = '2.103.071'
+VERSION = '2.623.191'
 CONTACT = 'bright.tiger@mail.com' # michael nagy
 
-import os, sys, time, json
+import os, sys, time, json, math, collections, contextlib, threading, random
 
 print()
 print("%s %s" % (PROGRAM, VERSION))
@@ -28,30 +28,94 @@ print()
 #   python3 setup.py install --user
 #==============================================================================
 
-try:
-  import minimalmodbus
-except:
-  print('%s' % ( '''\
+def ImportModbus():
+  global minimalmodbus
+  try:
+    import minimalmodbus
+  except:
+    print('%s' % ( '''\
 *** the python3 library 'minimalmodbus' is not installed.  to fix this
 *** sad state of affairs, run the following command and try again:
 
   pip3 install minimalmodbus
 '''))
-  os._exit(1)
+    os._exit(1)
+
+#==============================================================================
+# how hard to try each modbus transaction before giving up on the supply.  a
+# failed attempt is retried after backoff seconds, doubling each time, for up
+# to attempts tries and as long as the next attempt could still complete
+# within deadline seconds of the first.  timeout is the serial timeout for
+# each individual attempt.
+#==============================================================================
 
-minimalmodbus.TIMEOUT = 0.5
+class RetryPolicy:
+  def __init__(self, attempts=5, timeout=0.5, backoff=0.01, deadline=5.0):
+    self.attempts = attempts
+    self.timeout  = timeout
+    self.backoff  = backoff
+    self.deadline = deadline
+
+  def __repr__(self):
+    return 'attempts %d, timeout %d ms, backoff %d ms, deadline %d ms' % (
+      self.attempts, self.timeout * 1000, self.backoff * 1000, self.deadline * 1000
+    )
+
+#==============================================================================
+# a decoded, immutable picture of registers 0-41, all read in the same modbus
+# transaction and so all from the same instant.  'time' is the host time at
+# which the block arrived.
+#==============================================================================
+
+Telemetry = collections.namedtuple('Telemetry', [
+  'time', 'type', 'serial', 'firmware',
+  'temp_internal', 'tempf_internal', 'temp_external', 'tempf_external',
+  'voltage', 'current', 'measvoltage', 'meascurrent', 'measpower',
+  'input_voltage', 'ocpovp', 'CVCC', 'enable',
+  'battmode', 'battvoltage', 'measah', 'measwh'
+])
+
+#==============================================================================
+# one memory preset, M0-M9, as held in registers 80-119, four to a slot.  M0
+# is the working set; recalling a preset (register 19) copies it there.
+#==============================================================================
+
+Preset = collections.namedtuple('Preset', ['voltage', 'current', 'ovp', 'ocp'])
+
+#==============================================================================
+# the part of the register map a watchdog needs, registers 4-18, read in one
+# (shorter) transaction so that it can be polled as fast as the link allows
+#==============================================================================
+
+Status = collections.namedtuple('Status', [
+  'time', 'temp_internal', 'measvoltage', 'meascurrent', 'measpower',
+  'ocpovp', 'CVCC', 'enable'
+])
 
 class RD6006:
-  def __init__(self, port, address=1, baudrate=115200):
+  SNAPSHOT_LENGTH = 42 # registers 0-41
+
+  def __init__(self, port, address=1, baudrate=115200, policy=None, instrument=None):
     self.port = port
     self.address = address
-    self.instrument = minimalmodbus.Instrument(port=port, slaveaddress=address)
+    self.policy = policy or RetryPolicy()
+    self.stats = {}
+    self.lock = threading.RLock() # one transaction at a time on the link
+    self.writetime = None # smoothed round-trip time of a write, seconds
+    if instrument:
+      self.instrument = instrument
+    else:
+      self.instrument = minimalmodbus.Instrument(port=port, slaveaddress=address)
     self.instrument.serial.baudrate = baudrate
+    self.use_policy(self.policy)
     regs = self._read_registers(0, 4)
     self.sn = regs[1] << 16 | regs[2]
     self.fw = regs[3] / 100
     self.type = int(regs[0] / 10)
     self.voltres = 100
+    self.cached = False # serve properties from the most recent snapshot
+    self.regs = None
+    self.local = threading.local() # batching is per thread
 
     if self.type == 6012 or self.type == 6018:
       self.ampres = 100 # RD6012 or RD6018
@@ -64,28 +128,249 @@ class RD6006:
   def __exit__(self, type, value, traceback):
     pass
 
+  def close(self):
+    self.instrument.serial.close()
+
+  def use_policy(self, policy):
+    """switches to a different retry policy, and its per-attempt timeout"""
+    self.policy = policy
+    self.instrument.serial.timeout = policy.timeout
+
   def __repr__(self):
     return f"RD6006 SN:{self.sn} FW:{self.fw}"
 
+  @property
+  def pending(self):
+    """register -> value, while the calling thread is batching writes.  other
+    threads (a watchdog, say) write straight through"""
+    return getattr(self.local, 'pending', None)
+
+  @pending.setter
+  def pending(self, value):
+    self.local.pending = value
+
+  def _transact(self, register, function, *args):
+    """performs one modbus transaction under the retry policy, keeping count
+    of attempts, retries, failures and retry latency for the register.  when
+    the policy is exhausted the last modbus error is raised"""
+    policy = self.policy
+    stats = self.stats.setdefault(register, {
+      'transactions': 0, 'retries': 0, 'failures': 0, 'retrytime': 0.0
+    })
+    stats['transactions'] += 1
+    start = time.monotonic()
+    backoff = policy.backoff
+    attempt = 1
+    while True:
+      try:
+        with self.lock:
+          began = time.monotonic()
+          result = function(*args)
+          if function.__name__.startswith('write'):
+            self._note_write(time.monotonic() - began)
+        if attempt > 1:
+          stats['retrytime'] += time.monotonic() - start
+        return result
+      except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError):
+        elapsed = time.monotonic() - start
+        if attempt >= policy.attempts or elapsed + backoff + policy.timeout > policy.deadline:
+          stats['failures'] += 1
+          stats['retrytime'] += elapsed
+          raise
+      stats['retries'] += 1
+      attempt += 1
+      time.sleep(backoff)
+      backoff *= 2
+
+  def _note_write(self, seconds):
+    if self.writetime is None:
+      self.writetime = seconds
+    else:
+      self.writetime = 0.8 * self.writetime + 0.2 * seconds
+
+  def calibrate(self, count=3):
+    """measures the write round-trip time, by rewriting the voltage set-point
+    with its current value, and returns it in seconds"""
+    value = self._read_register(8)
+    for index in range(count):
+      self._write_register(8, value)
+    return self.writetime
+
+  def retry_stats(self):
+    """returns {register: {transactions, retries, failures, retrytime}}"""
+    return {register: dict(stats) for register, stats in self.stats.items()}
+
   def _read_register(self, register):
-    try:
-      return self.instrument.read_register(register)
-    except minimalmodbus.NoResponseError:
-      return self._read_register(register)
+    return self._transact(register, self.instrument.read_register, register)
 
   def _read_registers(self, start, length):
-    try:
-      return self.instrument.read_registers(start, length)
-    except minimalmodbus.NoResponseError:
-      return self._read_registers(start, length)
-    except minimalmodbus.InvalidResponseError:
-      return self._read_registers(start, length)
+    return self._transact(start, self.instrument.read_registers, start, length)
 
   def _write_register(self, register, value):
+    if self.regs and register < len(self.regs):
+      self.regs[register] = value # keep the snapshot coherent with our writes
+    if self.pending is not None:
+      self.pending[register] = value
+      return
+    return self._transact(register, self.instrument.write_register, register, value)
+
+  def _write_registers(self, start, values):
+    """writes contiguous registers with one function 16 transaction"""
+    if self.pending is not None:
+      for offset, value in enumerate(values):
+        self._write_register(start + offset, value)
+      return
+    for offset, value in enumerate(values):
+      if self.regs and start + offset < len(self.regs):
+        self.regs[start + offset] = value
+    return self._transact(start, self.instrument.write_registers, start, list(values))
+
+  @contextlib.contextmanager
+  def batch(self):
+    """collects the writes made inside a with-block and flushes them on exit.
+    batches nest, with only the outermost one flushing"""
+    if self.pending is not None:
+      yield self
+      return
+    self.pending = {}
+    try:
+      yield self
+    finally:
+      self.flush()
+      self.pending = None
+
+  def flush(self):
+    """sends the writes collected so far in the current batch.  writes to
+    contiguous registers are merged into a single transaction, and the merged
+    runs are sent in the order in which each was first touched"""
+    pending = self.pending
+    if not pending:
+      return
+    order = list(pending)
+    runs = []
+    for register in sorted(pending):
+      if runs and runs[-1][0] + len(runs[-1][1]) == register:
+        runs[-1][1].append(pending[register])
+      else:
+        runs.append([register, [pending[register]]])
+    runs.sort(key=lambda run: min(
+      order.index(register) for register in range(run[0], run[0] + len(run[1]))
+    ))
+    self.pending = None
     try:
-      return self.instrument.write_register(register, value)
-    except minimalmodbus.NoResponseError:
-      return self._write_register(register, value)
+      for start, values in runs:
+        if len(values) == 1:
+          self._write_register(start, values[0])
+        else:
+          self._write_registers(start, values)
+    finally:
+      self.pending = {}
+
+  def _measured(self, register):
+    """reads a register in the snapshot block, from the most recent snapshot
+    if cached mode is on and a snapshot has been taken"""
+    if self.cached and self.regs:
+      return self.regs[register]
+    return self._read_register(register)
+
+  def _signed(self, register):
+    """reads a sign/magnitude register pair as a signed value"""
+    if self._measured(register):
+      return -1 * self._measured(register + 1)
+    else:
+      return 1 * self._measured(register + 1)
+
+  def _double(self, register):
+    """reads a high/low register pair as a 32-bit value"""
+    return self._measured(register) << 16 | self._measured(register + 1)
+
+  def snapshot(self):
+    """reads registers 0-41 in a single transaction and returns them decoded
+    as a Telemetry record.  the raw block is retained so that, with cached set,
+    the properties below are answered from it without touching the link"""
+    regs = self._read_registers(0, self.SNAPSHOT_LENGTH)
+    stamp = time.time()
+    self.regs = list(regs)
+    def signed(register):
+      if regs[register]:
+        return -1 * regs[register + 1]
+      return regs[register + 1]
+    return Telemetry(
+      time           = stamp,
+      type           = int(regs[0] / 10),
+      serial         = regs[1] << 16 | regs[2],
+      firmware       = regs[3] / 100,
+      temp_internal  = signed(4),
+      tempf_internal = signed(6),
+      temp_external  = signed(34),
+      tempf_external = signed(36),
+      voltage        = regs[8] / self.voltres,
+      current        = regs[9] / self.ampres,
+      measvoltage    = regs[10] / self.voltres,
+      meascurrent    = regs[11] / self.ampres,
+      measpower      = regs[13] / 100,
+      input_voltage  = regs[14] / self.voltres,
+      ocpovp         = regs[16],
+      CVCC           = regs[17],
+      enable         = regs[18],
+      battmode       = regs[32],
+      battvoltage    = regs[33],
+      measah         = (regs[38] << 16 | regs[39]) / 1000,
+      measwh         = (regs[40] << 16 | regs[41]) / 1000
+    )
+
+  def status(self):
+    """reads the internal temperature, measured output, protection state,
+    cv/cc state and output enable (registers 4-18) in a single transaction"""
+    regs = self._read_registers(4, 15)
+    stamp = time.time()
+    return Status(
+      time          = stamp,
+      temp_internal = -regs[1] if regs[0] else regs[1],
+      measvoltage   = regs[6] / self.voltres,
+      meascurrent   = regs[7] / self.ampres,
+      measpower     = regs[9] / 100,
+      ocpovp        = regs[12],
+      CVCC          = regs[13],
+      enable        = regs[14]
+    )
+
+  def measure(self):
+    """reads the measured output voltage, current and power in a single
+    transaction, for polling faster than a full snapshot allows"""
+    regs = self._read_registers(10, 4)
+    return regs[0] / self.voltres, regs[1] / self.ampres, regs[3] / 100
+
+  def presets(self):
+    """reads all ten memory presets, M0-M9, in a single transaction and
+    returns them as a list of Preset records"""
+    regs = self._read_registers(80, 40)
+    return [Preset(
+      voltage = regs[M * 4] / self.voltres,
+      current = regs[M * 4 + 1] / self.ampres,
+      ovp     = regs[M * 4 + 2] / self.voltres,
+      ocp     = regs[M * 4 + 3] / self.ampres
+    ) for M in range(10)]
+
+  def upload_presets(self, presets, first=1):
+    """writes consecutive memory presets, starting at slot first, in a single
+    multi-register transaction"""
+    values = []
+    for preset in presets:
+      values += [
+        int(round(preset.voltage * self.voltres)), int(round(preset.current * self.ampres)),
+        int(round(preset.ovp * self.voltres)), int(round(preset.ocp * self.ampres))
+      ]
+    self._write_registers(80 + first * 4, values)
+
+  def recall(self, M):
+    """recalls memory preset M, setting voltage, current, ovp and ocp together
+    with a single register write.  in a batch, the recall is a barrier: the
+    writes before it are sent first and those after it follow, so that the
+    merging of runs cannot reorder set-points across it"""
+    self.flush()
+    self._write_register(19, int(M))
+    self.flush()
 
   def _mem(self, M=0):
     """reads the 4 register of a Memory[0-9] and print on a single line"""
@@ -104,83 +389,67 @@ class RD6006:
 
   @property
   def input_voltage(self):
-    return self._read_register(14) / self.voltres
+    return self._measured(14) / self.voltres
 
   @property
   def voltage(self):
-    return self._read_register(8) / self.voltres
+    return self._measured(8) / self.voltres
 
   @property
   def meastemp_internal(self):
-    if self._read_register(4):
-      return -1 * self._read_register(5)
-    else:
-      return 1 * self._read_register(5)
+    return self._signed(4)
 
   @property
   def meastempf_internal(self):
-    if self._read_register(6):
-      return -1 * self._read_register(7)
-    else:
-      return 1 * self._read_register(7)
+    return self._signed(6)
 
   @property
   def meastemp_external(self):
-    if self._read_register(34):
-      return -1 * self._read_register(35)
-    else:
-      return 1 * self._read_register(35)
+    return self._signed(34)
 
   @property
   def meastempf_external(self):
-    if self._read_register(36):
-      return -1 * self._read_register(37)
-    else:
-      return 1 * self._read_register(37)
+    return self._signed(36)
 
   @voltage.setter
   def voltage(self, value):
-    self._write_register(8, int(value * self.voltres))
+    self._write_register(8, int(round(value * self.voltres)))
 
   @property
   def measvoltage(self):
-    return self._read_register(10) / self.voltres
+    return self._measured(10) / self.voltres
 
   @property
   def meascurrent(self):
-    return self._read_register(11) / self.ampres
+    return self._measured(11) / self.ampres
 
   @property
   def measpower(self):
-    return self._read_register(13) / 100
+    return self._measured(13) / 100
 
   @property
   def measah(self):
-    return (
-      self._read_register(38) << 16 | self._read_register(39)
-    ) / 1000  # TODO check 16 or 8 bit
+    return self._double(38) / 1000  # TODO check 16 or 8 bit
 
   @property
   def measwh(self):
-    return (
-      self._read_register(40) << 16 | self._read_register(41)
-    ) / 1000  # TODO check 16 or 8 bit
+    return self._double(40) / 1000  # TODO check 16 or 8 bit
 
   @property
   def battmode(self):
-    return self._read_register(32)
+    return self._measured(32)
 
   @property
   def battvoltage(self):
-    return self._read_register(33)
+    return self._measured(33)
 
   @property
   def current(self):
-    return self._read_register(9) / self.ampres
+    return self._measured(9) / self.ampres
 
   @current.setter
   def current(self, value):
-    self._write_register(9, int(value * self.ampres))
+    self._write_register(9, int(round(value * self.ampres)))
 
   @property
   def voltage_protection(self):
@@ -188,7 +457,7 @@ class RD6006:
 
   @voltage_protection.setter
   def voltage_protection(self, value):
-    self._write_register(82, int(value * self.voltres))
+    self._write_register(82, int(round(value * self.voltres)))
 
   @property
   def current_protection(self):
@@ -196,11 +465,11 @@ class RD6006:
 
   @current_protection.setter
   def current_protection(self, value):
-    self._write_register(83, int(value * self.ampres))
+    self._write_register(83, int(round(value * self.ampres)))
 
   @property
   def enable(self):
-    return self._read_register(18)
+    return self._measured(18)
 
   @enable.setter
   def enable(self, value):
@@ -208,11 +477,11 @@ class RD6006:
 
   @property
   def ocpovp(self):
-    return self._read_register(16)
+    return self._measured(16)
 
   @property
   def CVCC(self):
-    return self._read_register(17)
+    return self._measured(17)
 
   @property
   def backlight(self):
@@ -235,9 +504,7 @@ class RD6006:
   def date(self, value):
     """Sets the date, needs tuple with (year, month, day) as argument"""
     year, month, day = value
-    self._write_register(48, year)
-    self._write_register(49, month)
-    self._write_register(50, day)
+    self._write_registers(48, [year, month, day])
 
   @property
   def time(self):
@@ -252,9 +519,132 @@ class RD6006:
   def time(self, value):
     """sets the time, needs time with (h, m, s) as argument"""
     h, m, s = value
-    self._write_register(51, h)
-    self._write_register(52, m)
-    self._write_register(53, s)
+    self._write_registers(51, [h, m, s])
+
+#==============================================================================
+# an in-process stand-in for minimalmodbus.Instrument talking to an rd6006, so
+# that sequences can be dry-run, and the driver timed, without a supply.  it
+# implements the part of the register map used by the RD6006 class, and a
+# resistive load on the output so that the measurements, cv/cc state and
+# ocp/ovp protection behave plausibly.
+#
+# each transaction takes latency seconds plus the time its request and
+# response frames would spend on the wire at the configured baud rate, and a
+# droprate fraction of them are lost, after the serial timeout, as a real
+# link would lose them.  all delays are divided by speed, for dry runs at
+# accelerated time.
+#==============================================================================
+
+class SimulatedSerial:
+  def __init__(self):
+    self.baudrate = 115200
+    self.timeout = 0.5
+
+  def close(self):
+    pass
+
+class SimulatedRD6006:
+  def __init__(self, serial=10001, latency=0.010, droprate=0.0, speed=1.0, load=10.0, settle=0.1):
+    self.serial = SimulatedSerial()
+    self.latency = latency
+    self.droprate = droprate
+    self.speed = speed
+    self.load = load # ohms
+    self.settle = settle # time constant of the output, seconds
+    self.output = [0.0, 0.0] # volts, amps
+    self.stamp = time.monotonic()
+    self.registers = [0] * 120
+    self.registers[0] = 60065
+    self.registers[1] = serial >> 16
+    self.registers[2] = serial & 0xffff
+    self.registers[3] = 140
+    self.registers[5] = 25    # internal temperature, celsius
+    self.registers[7] = 77    # internal temperature, fahrenheit
+    self.registers[14] = 2400 # input voltage, 10 mv units
+    self.registers[82] = 6200 # ovp, 10 mv units
+    self.registers[83] = 6200 # ocp, 1 ma units
+    for M in range(1, 10):
+      self.registers[80 + M * 4:84 + M * 4] = [500 * M, 1000, 6200, 6200]
+
+  def _exchange(self, request, response):
+    """spends the time for one transaction, with request and response frame
+    lengths in bytes, possibly losing the response"""
+    wire = (request + response) * 10.0 / self.serial.baudrate
+    if random.random() < self.droprate:
+      time.sleep((request * 10.0 / self.serial.baudrate + self.serial.timeout) / self.speed)
+      raise minimalmodbus.NoResponseError('simulated lost response')
+    time.sleep((self.latency + wire) / self.speed)
+
+  def _update(self):
+    """recomputes the measured output from the set-points and the load.  the
+    output approaches its steady state exponentially, as if the load were
+    bypassed by a capacitor"""
+    regs = self.registers
+    volts = regs[8] / 100
+    amps = regs[9] / 1000
+    if regs[18]:
+      if volts > regs[82] / 100:
+        regs[16] = 1 # ovp
+      elif min(amps, volts / self.load) > regs[83] / 1000:
+        regs[16] = 2 # ocp
+    if regs[16]:
+      regs[18] = 0
+    if regs[18]:
+      if volts / self.load > amps:
+        regs[17] = 1 # cc
+        volts = amps * self.load
+      else:
+        regs[17] = 0 # cv
+        amps = volts / self.load
+    else:
+      volts = 0.0
+      amps = 0.0
+    stamp = time.monotonic()
+    blend = 1.0
+    if self.settle:
+      blend -= math.exp(-(stamp - self.stamp) * self.speed / self.settle)
+    self.stamp = stamp
+    self.output[0] += (volts - self.output[0]) * blend
+    self.output[1] += (amps - self.output[1]) * blend
+    volts, amps = self.output
+    regs[10] = int(round(volts * 100))
+    regs[11] = int(round(amps * 1000))
+    regs[13] = int(round(volts * amps * 100))
+
+  def read_register(self, register):
+    self._exchange(8, 7)
+    self._update()
+    return self.registers[register]
+
+  def read_registers(self, start, length):
+    self._exchange(8, 5 + 2 * length)
+    self._update()
+    return self.registers[start:start + length]
+
+  def _recall(self, M):
+    """copies memory preset M into the working set"""
+    regs = self.registers
+    regs[80:84] = regs[80 + M * 4:84 + M * 4]
+    regs[8:10] = regs[80:82]
+
+  def write_register(self, register, value):
+    self._exchange(11, 8) # function 16, one register
+    self.registers[register] = int(value)
+    if register == 18 and value:
+      self.registers[16] = 0 # turning on clears a protection trip
+    if register == 19:
+      self._recall(int(value))
+    self._update()
+
+  def write_registers(self, start, values):
+    self._exchange(9 + 2 * len(values), 8)
+    for offset, value in enumerate(values):
+      self.registers[start + offset] = int(value)
+    if start <= 18 < start + len(values) and self.registers[18]:
+      self.registers[16] = 0
+    if start <= 19 < start + len(values):
+      self._recall(self.registers[19])
+    self._update()
 
 #==============================================================================
 # show usage help
@@ -262,6 +652,9 @@ class RD6006:
 
 OutputFileName    = None
 SemaphoreFileName = None
+Policy            = RetryPolicy()
+SampleInterval    = None
+Simulate          = None
 
 def ShowHelp():
   HelpText = '''\
@@ -270,19 +663,63 @@ def ShowHelp():
 
 usage:
 
-    %s [-h] [-i=1/2/3/4...] [-o=filename[.json]] command {command {command...}}
+    %s [-h] [-a=#[,#]] [-b[=#]] [-i=1/2/3/4...] [-o=filename[.json]] [-r=###] [-t=#[,#[,#[,#]]]]
+      [-d[=#[,#[,#]]]] [-l[=#]] [-m[=file]] [-w=limits] [-u[=socket]]
+      [-c[=socket]]
+      command {command {command...}}
 
 where:
 
     -h . . . . . . this help text
+    -a=#,# . . . . sweep settling: readings that must agree, milliseconds
+                   between readings (default %d,%d)
+    -b=# . . . . . benchmark the modbus link, repeating each case # times
+                   (default 100), instead of running commands
+    -c=xxxxx . . . send the commands to the daemon on this socket (default
+                   '%s')
+    -d=#,#,# . . . dry run on a simulated supply: latency (milliseconds),
+                   dropped responses (percent), speed-up factor
+                   (default 10,0,1)
     -i=# . . . . . specify power supply index (default 1) or serial number
+    -l=# . . . . . compensate for write latency, optionally spinning for the
+                   last # milliseconds (float) of each wait
+    -m=xxxxx . . . show the memory presets M0-M9, first uploading any given
+                   in this csv file (optional)
     -o=xxxxx . . . name of output file (optional)
+    -r=### . . . . sample measured output every ### milliseconds (optional)
     -s=xxxxx . . . name of semaphore file (optional)
+    -t=#,#,#,# . . modbus retry policy: attempts, timeout, backoff, deadline
+                   (milliseconds after attempts, default %d,%d,%d,%d)
+    -u=xxxxx . . . run as a daemon serving the socket (default as for -c)
+    -w=a#,w#,v#,t#,cc
+                   watchdog limits: current (amps), power (watts), voltage
+                   (volts), internal temperature (celsius) and cv to cc
+                   transitions, any of which may be given
     command  . . . command, as listed below (repeat as desired)
 
 if more than one power supply, select the desired one by supplying an integer
 index, 1 for the first one, 2 for the second one, etc.
 
+a daemon (-u) opens the supplies given with -i= options, or else all of
+them, keeps them open, and runs sequences sent to it by clients (-c) over a
+unix socket, so that each run costs a socket round trip rather than a program
+start and probe.  a client takes the same commands and -a=, -i=, -o=, -r=,
+-s= and -w= options as a normal run; its sequences start from the supplies'
+actual set-points, and the daemon returns the dataset for the client to
+write.
+
+supplies are probed in parallel, and the port on which each serial number was
+last found is remembered in ~/.at-rd6000-cache.json so that, as long as the
+usb device on that port is unchanged, only that port needs probing next time.
+
+several supplies can be driven at once by following one supply's commands
+with another -i= option and that supply's commands, and so on.  the
+sequences run in parallel on a common clock, and the output file holds the
+channels of every supply, prefixed with its serial number (18927.volts, ...).
+for example:
+
+  -o=both -i=18927 v=0,on,s=1,v=10,s=38,v=0,off -i=19103 v=5,on [v+0.01,m=15]=150 off
+
 if a semaphore file is specified, the program will intialized, but then wait for
 the semaphore file to be present before starting the command sequence.
 
@@ -311,6 +748,22 @@ commands may be any of:
     ocp=### . . . . set overcurrent protection (float, amps)
     ovp=### . . . . set overvoltage protection (float, volts)
 
+    recall=# . . .  recall memory preset M1-M9 (integer)
+
+    ramp=v:#:#:#[:lin|exp|sin]
+    ramp=c:#:#:#[:lin|exp|sin]
+                    ramp voltage (v) or current (c) from its set-point to a
+                    target (float), over seconds (float), in steps (integer)
+
+    wave=file . . . run the piecewise waveform in a csv file
+
+    sweep=v:#:#[:#[:#]]
+    sweep=c:#:#[:#[:#]]
+                    sweep voltage (v) or current (c) from its set-point to a
+                    target (float) in steps (integer), settling each point to
+                    a tolerance (float, default 0.01) for at most a maximum
+                    dwell (float seconds, default 5)
+
 commands may also be concatenated and separated by commas, allowing a more
 compact notation.  for example, this command sequence sets to voltage to
 zero, turns the supply on, ramps the voltage from zero to 5 volts in 10 steps
@@ -319,18 +772,109 @@ of 500mv at a rate of one step per second, then turns the supply off:
   v=0,on [v+0.5,s=1]=10 off
 
 note that groups can be nested, allowing for some complex sequences.
+
+the same ramp can be written as a single ramp command, which computes each
+set-point from the start and target, so that long ramps don't accumulate
+rounding errors, and which can also be exponential (fast at first, then
+settling on the target) or one cycle of a sine wave (out to the target and
+back again):
+
+  v=0,on ramp=v:5:10:10 off
+
+a wave command runs the waveform in a csv file, such as a recorded battery
+discharge curve, with one point per line as seconds (from the start of the
+waveform), volts and amps.  a blank volts or amps leaves that set-point as it
+was, and blank lines, lines starting with # and a heading on the first line
+are skipped.  the file is read as the waveform runs, so it can be any length.
+set-points are recorded in the output file as sent to the supply, at its
+resolution.
+
+a sweep command steps the voltage or current like a ramp, but instead of
+waiting a fixed time at each point it polls the measured output until the
+last few readings (-a) agree, in both volts and amps, to within the tolerance
+(or the maximum dwell runs out), so each point takes only as long as the load
+needs to settle.  a point is not taken as settled until the output has been
+seen to move from where it was before the step, or is already within the
+tolerance of the set-point.  the rest of the sequence is pushed back by however long
+the sweep took.  the settled points are written, as an i-v dataset, to a
+second output file named with an -iv suffix.  for example, this traces the
+i-v curve of a load from 0 to 12 volts in 60 points:
+
+  v=0,on sweep=v:12:60:0.01:2 off
+
+if a sample rate is specified, a background sampler reads the measured output
+voltage, current, power and cv/cc state from the supply at that rate while
+the sequence runs, and records them as the extra channels meas.volts,
+meas.amps, meas.watts and meas.cvcc (0 for cv, 1 for cc) in the output file.
+every sample set holds the current set-points as well as the most recent
+measurements.
+
+with latency compensation (-l), the round-trip time of a write to each supply
+is measured before the sequence starts, and kept up to date as it runs, and
+every step is issued that much ahead of its deadline so that set-points take
+effect on time.  sleeping can overshoot by a millisecond or so, so for steps
+of a few milliseconds a spin window makes the last part of each wait a busy
+wait instead.  either way, the requested and achieved period between
+set-points is reported at the end of the run.
+
+memory presets (-m) are shown, or uploaded from a csv file and shown, before
+any commands are run.  the file has one preset per line as slot (0-9),
+volts, amps, ovp and ocp; blank lines, lines starting with # and a heading
+on the first line are skipped.  all ten presets are read in one modbus
+transaction, and uploaded in another.  a recall command then sets voltage,
+current, ovp and ocp together, in a single write, so they change at once
+rather than passing through a mix of old and new values:
+
+  -m=presets.csv v=0,on recall=1,s=10 recall=2,s=10 off
+
+a watchdog (-w) polls each supply's measured output, protection and cv/cc
+state as fast as the link allows, in parallel with its sequence, and turns
+the output off as soon as a limit is exceeded, abandoning the sequence.  the
+time from the poll that saw the fault to the output being off is reported
+with each trip.  for example, to trip above 2.5 amps or on entering cc:
+
+  -w=a2.5,cc v=5,on [v+0.5,s=1]=10 off
+
+a benchmark (-b) times reads of 1 to 42 contiguous registers, writes of one
+and two registers (which rewrite the set-points with their own values),
+and single reads under a range of timeouts, against each selected supply.
+on a dry run the simulated link is also swept over the standard baud rates.
+latency percentiles, throughput, retries and failures are shown for each
+case, and written as a json report to the output file if one is given.
+
+a dry run (-d) executes the sequence against a simulated supply, with a 10
+ohm load on its output, instead of a real one.  the simulated link takes the
+given latency plus the wire time of each transaction, and drops the given
+percentage of responses.  a speed-up factor above 1 runs the whole sequence,
+and the simulated link, that many times faster than real time; times are
+still reported in simulated seconds.
+
+a modbus transaction that gets no (or a garbled) response is retried after
+the backoff delay, which doubles on each retry, until either the attempts
+or the deadline run out.  the retries taken are reported at the end of the
+run, per register, so the timeout can be tuned to the link.
 '''
-  print(HelpText % (sys.argv[0]))
+  print(HelpText % (sys.argv[0], SettleDefaults[0], SettleDefaults[1] * 1000,
+    DefaultSocketName, Policy.attempts, Policy.timeout * 1000,
+    Policy.backoff * 1000, Policy.deadline * 1000))
+  if Serving:
+    raise RequestError() # the help text is all there is to say
   os._exit(1)
 
 #==============================================================================
 # parse error
 #==============================================================================
 
+Serving = False # true while a daemon handles a request, which must not exit
+CommandLine = sys.argv
+
+class RequestError(Exception):
+  pass
+
 def ShowError(Message=None):
   print('*** the command line:')
   print()
-  print('  %s' % (' '.join(sys.argv)))
+  print('  %s' % (' '.join(CommandLine)))
   print()
   if Message:
     print('*** %s' % (Message))
@@ -338,11 +882,21 @@ def ShowError(Message=None):
     print('*** could not be parsed. see the -h help information!')
   print('*** see the -h help information!')
   print()
+  if Serving:
+    raise RequestError(Message or 'the command line could not be parsed')
   os._exit(1)
 
 def ShowErrorToken(Token):
   ShowError('could not be parsed because of this token: %s' % (Token))
 
+def ShowSupplyError(Message):
+  print()
+  print('*** %s' % (Message))
+  print()
+  if Serving:
+    raise RequestError(Message)
+  os._exit(1)
+
 #==============================================================================
 # validate an integer or float command or throw an error.  also set a globel
 # as a side-effect.
@@ -355,7 +909,7 @@ def ValidInteger(Command, Length):
   if len(Command) > Length:
     try:
       Integer = int(Command[Length:])
-    except:
+    except ValueError:
       ShowErrorToken(Command)
   else:
     ShowErrorToken(Command)
@@ -368,7 +922,7 @@ def ValidFloat(Command, Length):
   if len(Command) > Length:
     try:
       Float = float(Command[Length:])
-    except:
+    except ValueError:
       ShowErrorToken(Command)
   else:
     ShowErrorToken(Command)
@@ -415,119 +969,766 @@ def TokenSplit(String):
   return tx
 
 #==============================================================================
-# run a sequence of commands, possibly recursively
+# compile a (possibly nested) sequence of commands into a flat timeline.  each
+# step carries its deadline, in seconds from the start of the run, along with
+# the set-points in force once it has executed, so that all the arithmetic of
+# relative steps and repeats is done before the supply is touched (set-points
+# recalled from memory presets are known once the presets have been read).  the
+# timeline is generated as it is consumed rather than built up front, so that
+# long ramps and waveforms run in bounded memory.
 #==============================================================================
 
-Supply = None
+Step = collections.namedtuple('Step', [
+  'deadline', 'command', 'parameter', 'volts', 'amps', 'cursor'
+])
 
-Amps  = 0.0
-Volts = 0.0
-Time0 = 0.0
-
-OutputSet = []
-
-def RunSequence(Sequence, Repeats, Depth):
-  global Amps, Volts, Time0
-  if Depth == 1:
-    print('  step/steps          secs   volts    amps  command')
-    print('  ---------------  -------  ------  ------  ---------')
-    Time0 = time.time()
+def CompileSequence(Sequence, Repeats, Depth, State):
   for Repeat in range(Repeats):
     for Token in Sequence:
       Command = Token[0]
       Parameter = Token[1]
       if Command.startswith('*'):
-        RunSequence(Parameter, int(Command[1:]), Depth+1)
-      else:
-        Time = time.time() - Time0
-        if Command == 'on':
-          Supply.enable = 1
-          Parameter = ''
-        elif Command == 'off':
-          Supply.enable = 0
-          Parameter = ''
-        elif Command == 'bl+':
-          Supply.backlight = 4
-          Parameter = ''
-        elif Command == 'bl-':
-          Supply.backlight = 1
-          Parameter = ''
-        elif Command == 'm':
-          time.sleep(float(Parameter) / 1000.0)
-          Parameter = '=%d' % (Parameter)
-        elif Command == 's':
-          time.sleep(Parameter)
-          Parameter = '=%1.3f' % (Parameter)
-        elif Command == 'c=':
-          Amps = Parameter
-          Supply.current = Amps
-          Parameter = '%1.3f' % (Parameter)
-          OutputSet.append({'time': Time, 'values': [Volts, Amps]})
-        elif Command == 'c+':
-          Amps += Parameter
-          Supply.current = Amps
-          Parameter = '%1.3f' % (Parameter)
-          OutputSet.append({'time': Time, 'values': [Volts, Amps]})
-        elif Command == 'c-':
-          Amps -= Parameter
-          Supply.current = Amps
-          Parameter = '%1.3f' % (Parameter)
-          OutputSet.append({'time': Time, 'values': [Volts, Amps]})
-        elif Command == 'v=':
-          Volts = Parameter
-          Supply.voltage = Volts
-          Parameter = '%1.3f' % (Parameter)
-          OutputSet.append({'time': Time, 'values': [Volts, Amps]})
-        elif Command == 'v+':
-          Volts += Parameter
-          Supply.voltage = Volts
-          Parameter = '%1.3f' % (Parameter)
-          OutputSet.append({'time': Time, 'values': [Volts, Amps]})
-        elif Command == 'v-':
-          Volts -= Parameter
-          Supply.voltage = Volts
-          Parameter = '%1.3f' % (Parameter)
-          OutputSet.append({'time': Time, 'values': [Volts, Amps]})
-        elif Command == 'ocp=':
-          Supply.current_protection = Parameter
-          Parameter = '%1.3f' % (Parameter)
-        elif Command == 'ovp=':
-          Supply.voltage_protection = Parameter
-          Parameter = '%1.3f' % (Parameter)
-        else:
-          print('*** unknown command: %s' % (Command))
-          os._exit(1)
-        Cursor = '%s%02d/%02d' % ('  ' * Depth, Repeat+1, Repeats)
-        while len(Cursor) < 18:
-          Cursor += ' '
-        print('%s %7.2f  %6.3f  %6.3f  %s%s' % (
-          Cursor, Time, Volts, Amps, Command, Parameter
-        ))
+        yield from CompileSequence(Parameter, int(Command[1:]), Depth+1, State)
+        continue
+      if Command == 'ramp':
+        yield from CompileRamp(Parameter, Depth+1, State)
+        continue
+      if Command == 'wave':
+        yield from CompileWave(Parameter, Depth+1, State)
+        continue
+      if Command == 'sweep':
+        yield from CompileSweep(Parameter, Depth+1, State)
+        continue
+      if Command == 'recall' and State.get('presets'):
+        State['volts'] = State['presets'][Parameter].voltage
+        State['amps'] = State['presets'][Parameter].current
+      if Command == 'c=':
+        State['amps'] = Parameter
+      elif Command == 'c+':
+        State['amps'] += Parameter
+      elif Command == 'c-':
+        State['amps'] -= Parameter
+      elif Command == 'v=':
+        State['volts'] = Parameter
+      elif Command == 'v+':
+        State['volts'] += Parameter
+      elif Command == 'v-':
+        State['volts'] -= Parameter
+      Cursor = '%s%02d/%02d' % ('  ' * Depth, Repeat+1, Repeats)
+      yield Step(State['time'], Command, Parameter,
+        State['volts'], State['amps'], Cursor)
+      if Command == 'm':
+        State['time'] += Parameter / 1000.0
+      elif Command == 's':
+        State['time'] += Parameter
+
+#==============================================================================
+# generate the set-points of a ramp, from the set-point in force to a target,
+# in a number of equal steps spread over a number of seconds.  each step is
+# computed from its index, so nothing accumulates rounding error however long
+# the ramp.  the shape is linear, exponential (fast at first, then settling
+# on the target), or one cycle of a sine wave (out to the target and back).
+#==============================================================================
+
+RampShapes = {
+  'lin': lambda x: x,
+  'exp': lambda x: (1.0 - math.exp(-4.0 * x)) / (1.0 - math.exp(-4.0)),
+  'sin': lambda x: (1.0 - math.cos(2.0 * math.pi * x)) / 2.0,
+}
+
+def CompileRamp(Ramp, Depth, State):
+  Channel, Target, Seconds, Steps, Shape = Ramp
+  Key = {'v': 'volts', 'c': 'amps'}[Channel]
+  Start = State[Key]
+  Time = State['time']
+  for Index in range(1, Steps + 1):
+    State[Key] = Start + (Target - Start) * RampShapes[Shape](Index / Steps)
+    State['time'] = Time + Seconds * (Index - 1) / Steps
+    yield Step(State['time'], Channel + '=', State[Key],
+      State['volts'], State['amps'], '%s%03d/%03d' % ('  ' * Depth, Index, Steps))
+  State['time'] = Time + Seconds
+
+#==============================================================================
+# generate the points of a sweep, from the set-point in force to a target in
+# a number of equal steps.  how long each point takes to settle is only known
+# as it runs, so a point takes no time on the timeline; instead the run
+# shifts everything after it by the time it actually took.
+#==============================================================================
+
+def CompileSweep(Sweep, Depth, State):
+  Channel, Target, Steps, Tolerance, Dwell = Sweep
+  Key = {'v': 'volts', 'c': 'amps'}[Channel]
+  Start = State[Key]
+  for Index in range(1, Steps + 1):
+    State[Key] = Start + (Target - Start) * Index / Steps
+    yield Step(State['time'], 'sweep', (Channel, Tolerance, Dwell),
+      State['volts'], State['amps'], '%s%03d/%03d' % ('  ' * Depth, Index, Steps))
+
+#==============================================================================
+# generate the set-points of a piecewise waveform read from a csv file, one
+# point per line as: seconds,volts,amps.  seconds are from the start of the
+# waveform, and a blank volts or amps leaves that set-point unchanged.  blank
+# lines and lines starting with # are skipped, as is a heading on the first
+# line.  the file is read as the waveform runs rather than loaded whole, and
+# the last set-points are held until the next command.
+#==============================================================================
+
+def CompileWave(FileName, Depth, State):
+  Time = State['time']
+  Last = 0.0
+  try:
+    File = open(FileName)
+  except OSError as Error:
+    ShowError("wave file '%s' could not be read (%s)" % (FileName, Error.strerror))
+  with File:
+    for Number, Line in enumerate(File, 1):
+      Fields = [Field.strip() for Field in Line.split(',')]
+      if not Fields[0] or Fields[0].startswith('#'):
+        continue
+      try:
+        Seconds = float(Fields[0])
+        Values = [float(Field) if Field else None for Field in (Fields[1:] + ['', ''])[:2]]
+        if Seconds < Last or len(Fields) > 3:
+          raise ValueError
+      except ValueError:
+        if Number == 1:
+          continue
+        ShowError("line %d of wave file '%s' could not be parsed" % (Number, FileName))
+      Last = Seconds
+      State['time'] = Time + Seconds
+      Cursor = '%s%05d' % ('  ' * Depth, Number)
+      for Command, Key, Value in [('v=', 'volts', Values[0]), ('c=', 'amps', Values[1])]:
+        if Value is not None:
+          State[Key] = Value
+          yield Step(State['time'], Command, Value,
+            State['volts'], State['amps'], Cursor)
+  State['time'] = Time + Last
+
+#==============================================================================
+# each supply taking part in a run is a job, holding the supply's selection
+# (by index or serial number), its command sequence, and the state of its
+# run.  jobs run in parallel, one worker thread per supply, against a shared
+# clock.
+#==============================================================================
+
+class SupplyJob:
+  def __init__(self):
+    self.index = 1
+    self.serial = None
+    self.selected = False
+    self.tokens = []
+    self.depth = 0
+    self.sequence = []
+    self.steps = 0
+    self.duration = 0.0
+    self.supply = None
+    self.name = ''
+    self.prefix = ''
+    self.volts = 0.0
+    self.amps = 0.0
+    self.measured = [0.0, 0.0, 0.0, 0] # volts, amps, watts, cv/cc
+    self.lateness = []
+    self.lead = 0.0
+    self.applied = [] # (deadline, time) of each group of set-points sent
+    self.shift = 0.0 # time taken by sweep points so far, seconds
+    self.swept = [0.0, 0.0, 0.0, 0.0, 0.0] # set-point, volts, amps, watts, settle ms
+    self.settles = [] # (seconds, settled) of each sweep point
+    self.presets = None # the supply's memory presets, read if recalled
+    self.tripped = threading.Event() # set by the watchdog to abandon the run
+    self.trips = [] # (time, reason, latency) of each watchdog trip
+    self.polls = 0
+    self.unanswered = 0
+    self.samples = 0
+    self.missed = 0
+
+  def timeline(self):
+    """generates the job's timeline, starting from its current set-points"""
+    State = {'time': 0.0, 'volts': self.volts, 'amps': self.amps, 'presets': self.presets}
+    return CompileSequence(self.sequence, 1, 1, State)
+
+Jobs = [SupplyJob()]
+
+#==============================================================================
+# the sequence clock, which runs Speed times faster than real time on dry runs
+#==============================================================================
+
+Speed = 1.0
+Time0 = 0.0
+
+def Now():
+  return time.monotonic() * Speed
+
+def Sleep(Seconds):
+  if Seconds > 0.0:
+    time.sleep(Seconds / Speed)
+
+#==============================================================================
+# wait for a deadline on the sequence clock.  the operating system's sleep can
+# overshoot by a millisecond or more, so with a spin window set the wait
+# sleeps until that much before the deadline and busy-waits the rest,
+# yielding on every pass so that the other jobs, the samplers and the
+# watchdog are not starved of the interpreter lock meanwhile.  the wait ends
+# early if the given event is set.
+#==============================================================================
+
+Compensate = False
+SpinWindow = 0.0
+
+def WaitUntil(Deadline, Stop=None):
+  Seconds = Deadline - SpinWindow - Now()
+  if Stop is None:
+    Sleep(Seconds)
+  elif Seconds > 0.0:
+    Stop.wait(Seconds / Speed)
+  if SpinWindow:
+    while Now() < Deadline and not (Stop and Stop.is_set()):
+      time.sleep(0)
+
+#==============================================================================
+# record a sample set holding the set-points (and, when sampling, the latest
+# measurements) of every supply, so all of them share one timebase
+#==============================================================================
+
+OutputSet = []
+OutputLock = threading.Lock()
+PrintLock = threading.Lock()
+
+def Record(Time):
+  Values = []
+  for Job in Jobs:
+    Values += [Job.volts, Job.amps]
+    if SampleInterval:
+      Values += Job.measured
+  with OutputLock:
+    OutputSet.append({'time': Time, 'values': Values})
+
+def Channels(Names=None):
+  Channels = []
+  for Job in Jobs:
+    if not Names:
+      Names = ['volts','amps']
+      if SampleInterval:
+        Names += ['meas.volts','meas.amps','meas.watts','meas.cvcc']
+    for Name in Names:
+      if len(Jobs) > 1:
+        Name = '%s.%s' % (Job.name, Name)
+      Channels.append(Name)
+  return Channels
+
+#==============================================================================
+# record the settled points of sweeps, as a separate i-v dataset with the same
+# timebase, holding for every supply the swept set-point, the settled output
+# and how long it took to settle
+#==============================================================================
+
+SweepSet = []
+SweepChannels = ['sweep.set','sweep.volts','sweep.amps','sweep.watts','sweep.ms']
+
+def RecordSweep(Time):
+  Values = []
+  for Job in Jobs:
+    Values += Job.swept
+  with OutputLock:
+    SweepSet.append({'time': Time, 'values': Values})
+
+#==============================================================================
+# run a compiled timeline against a monotonic clock.  each step waits for its
+# absolute deadline, so the time taken by modbus writes is absorbed by the
+# following delay instead of accumulating into the schedule.  this is called
+# inside a write batch, so that set-points sharing a deadline are coalesced
+# and sent together (merged where their registers are contiguous) before the
+# wait for the next deadline.  how late each step started is kept in the
+# job's lateness.  the set-points recorded are those the supply was sent,
+# at its resolution.
+#
+# with latency compensation, each step is issued early by the supply's
+# measured write round-trip time (kept up to date as the run goes on), so
+# that a set-point takes effect at its deadline rather than a round trip
+# after it.  the time at which each group of set-points was acknowledged is
+# kept in the job's applied list, to compare achieved and requested periods.
+#==============================================================================
+
+def SendSetPoints(Job, Pending):
+  Job.supply.flush()
+  if Pending is not None:
+    Job.applied.append((Pending, Now() - Time0))
+  if Compensate and Job.supply.writetime:
+    Job.lead = Job.supply.writetime * Speed
+
+#==============================================================================
+# run one point of a sweep: send its set-point, then poll the measured output
+# until the last few readings agree to within the tolerance, or the maximum
+# dwell runs out, and record the settled point.  the output is read once
+# before the set-point is sent, and a point only counts as settled once a
+# reading has moved away from that (or is already within tolerance of the
+# set-point), so that registers the supply has not yet updated are not taken
+# for a settled output.  the time this took shifts the rest of the job's
+# timeline.
+#==============================================================================
+
+SettleDefaults = (3, 0.020) # readings that must agree, seconds between them
+SettleReadings, SettlePoll = SettleDefaults
+
+def Settle(Job, Before, Channel, SetPoint, Tolerance, Dwell):
+  Start = Now()
+  Readings = []
+  Moved = False
+  while True:
+    Reading = Job.supply.measure()
+    Moved = Moved or Reading[:2] != Before[:2] or abs(Reading[Channel] - SetPoint) <= Tolerance
+    Readings = (Readings + [Reading])[-SettleReadings:]
+    Elapsed = Now() - Start
+    if Moved and len(Readings) == SettleReadings and all(
+      max(Reading[Index] for Reading in Readings) -
+      min(Reading[Index] for Reading in Readings) <= Tolerance for Index in [0, 1]
+    ):
+      return Readings[-1], Elapsed, True
+    if Elapsed >= Dwell or Job.tripped.is_set():
+      return Readings[-1], Elapsed, False
+    Sleep(SettlePoll)
+
+def SweepPoint(Job, Channel, Tolerance, Dwell):
+  Supply = Job.supply
+  Start = Now()
+  Before = Supply.measure()
+  if Channel == 'v':
+    Supply.voltage = Job.volts
+    SetPoint = Job.volts
+  else:
+    Supply.current = Job.amps
+    SetPoint = Job.amps
+  SendSetPoints(Job, None)
+  Record(Start - Time0)
+  Reading, Elapsed, Settled = Settle(Job, Before, 0 if Channel == 'v' else 1, SetPoint, Tolerance, Dwell)
+  Time = Now()
+  Job.shift += Time - Start
+  Job.settles.append((Elapsed, Settled))
+  Job.measured[:3] = Reading
+  Job.swept = [SetPoint, Reading[0], Reading[1], Reading[2], Elapsed * 1000]
+  RecordSweep(Time - Time0)
+  return '=%1.3f %s at %1.3fV %1.3fA after %d ms' % (
+    SetPoint, 'settled' if Settled else 'unsettled', Reading[0], Reading[1], Elapsed * 1000
+  )
+
+def RunTimeline(Job):
+  Supply = Job.supply
+  Pending = None
+  Deadline = 0.0
+  for Step in Job.timeline():
+    Command = Step.command
+    Parameter = Step.parameter
+    if Job.tripped.is_set():
+      break
+    if Step.deadline > Deadline:
+      SendSetPoints(Job, Pending)
+      Pending = None
+      Deadline = Step.deadline
+    WaitUntil(Time0 + Step.deadline + Job.shift - Job.lead, Job.tripped)
+    if Job.tripped.is_set():
+      break
+    Time = Now() - Time0
+    Late = Time - (Step.deadline + Job.shift - Job.lead)
+    Job.lateness.append(Late)
+    if Command in ['c=','c+','c-','v=','v+','v-','recall','sweep']:
+      Job.volts = round(Step.volts * Supply.voltres) / Supply.voltres # as sent
+      Job.amps = round(Step.amps * Supply.ampres) / Supply.ampres
+    if Command in ['c=','c+','c-','v=','v+','v-','recall'] and Pending is None:
+      Pending = Step.deadline
+    if Command == 'on':
+      Supply.enable = 1
+      Parameter = ''
+    elif Command == 'off':
+      Supply.enable = 0
+      Parameter = ''
+    elif Command == 'bl+':
+      Supply.backlight = 4
+      Parameter = ''
+    elif Command == 'bl-':
+      Supply.backlight = 1
+      Parameter = ''
+    elif Command == 'm':
+      Parameter = '=%d' % (Parameter)
+    elif Command == 's':
+      Parameter = '=%1.3f' % (Parameter)
+    elif Command in ['c=','c+','c-']:
+      Supply.current = Job.amps
+      Parameter = '%1.3f' % (Parameter)
+      Record(Time + Job.lead) # when it should take effect
+    elif Command in ['v=','v+','v-']:
+      Supply.voltage = Job.volts
+      Parameter = '%1.3f' % (Parameter)
+      Record(Time + Job.lead)
+    elif Command == 'recall':
+      Supply.recall(Parameter)
+      Parameter = '=%d' % (Parameter)
+      Record(Time + Job.lead)
+    elif Command == 'sweep':
+      Parameter = SweepPoint(Job, *Parameter)
+    elif Command == 'ocp=':
+      Supply.current_protection = Parameter
+      Parameter = '%1.3f' % (Parameter)
+    elif Command == 'ovp=':
+      Supply.voltage_protection = Parameter
+      Parameter = '%1.3f' % (Parameter)
+    else:
+      print('*** unknown command: %s' % (Command))
+      os._exit(1)
+    Cursor = Job.prefix + Step.cursor
+    while len(Cursor) < 18:
+      Cursor += ' '
+    with PrintLock:
+      print('%s %7.2f  %6.3f  %6.3f  %7.1f  %s%s' % (
+        Cursor, Time, Job.volts, Job.amps, Late * 1000, Command, Parameter
+      ))
+  else:
+    SendSetPoints(Job, Pending)
+    WaitUntil(Time0 + Job.duration + Job.shift, Job.tripped) # a trailing delay still holds the output
+  if Job.tripped.is_set():
+    Supply.pending.clear() # nothing more goes to a tripped supply
+    with PrintLock:
+      print('*** %ssequence abandoned by the watchdog' % (Job.prefix))
+
+def RunJob(Job):
+  try:
+    with Job.supply.batch():
+      RunTimeline(Job)
+  except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError) as Error:
+    with PrintLock:
+      print()
+      print('*** power supply %s stopped responding (%s) - sequence abandoned' % (Job.name, Error))
+
+#==============================================================================
+# watch a supply's output, independently of its sequence, by polling its
+# status as fast as the link allows, and turn the output off as soon as any
+# of the watchdog limits is exceeded.  the sequence is then abandoned.  a
+# trip by the supply's own ovp/ocp is reported too.  how long it took from
+# starting the poll that saw the fault to the output being off is logged as
+# the trip latency, and the output is turned off again should anything turn
+# it back on.
+#==============================================================================
+
+WatchLimits = None
+
+def CheckLimits(Status, Previous):
+  if Status.ocpovp:
+    return 'supply %s protection' % (['ovp','ocp'][Status.ocpovp == 2])
+  if Status.measvoltage > WatchLimits.get('v', Status.measvoltage):
+    return 'voltage %1.2fV over %1.2fV' % (Status.measvoltage, WatchLimits['v'])
+  if Status.meascurrent > WatchLimits.get('a', Status.meascurrent):
+    return 'current %1.3fA over %1.3fA' % (Status.meascurrent, WatchLimits['a'])
+  if Status.measpower > WatchLimits.get('w', Status.measpower):
+    return 'power %1.2fW over %1.2fW' % (Status.measpower, WatchLimits['w'])
+  if Status.temp_internal > WatchLimits.get('t', Status.temp_internal):
+    return 'temperature %dC over %dC' % (Status.temp_internal, WatchLimits['t'])
+  if 'cc' in WatchLimits and Previous and Status.CVCC and not Previous.CVCC:
+    return 'cv to cc transition'
+  return None
+
+def Watchdog(Job, Stop):
+  Previous = None
+  while not Stop.is_set():
+    Start = Now()
+    try:
+      Reading = Job.supply.status()
+      Job.polls += 1
+      Reason = CheckLimits(Reading, Previous)
+      Fresh = Previous is None or Reading.ocpovp != Previous.ocpovp
+      if Reason and (Reading.enable or Reading.ocpovp and Fresh):
+        if Reading.enable:
+          Job.supply.enable = 0
+        Latency = Now() - Start
+        Job.trips.append((Start - Time0, Reason, Latency))
+        Job.tripped.set()
+        with PrintLock:
+          print('*** %swatchdog tripped at %1.2f seconds: %s, output off after %1.1f ms' % (
+            Job.prefix, Start - Time0, Reason, Latency * 1000
+          ))
+      Previous = Reading
+    except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError):
+      Job.unanswered += 1
+    time.sleep(0.001) # let the sequence at the link between polls
+
+def ShowWatchdog(Job, Elapsed):
+  if not WatchLimits:
+    return
+  Latencies = [Latency for Time, Reason, Latency in Job.trips]
+  print('  %swatchdog: %d polls, %1.1f ms apart, %d unanswered, %d trips%s' % (
+    Job.prefix, Job.polls, Elapsed * 1000 / max(Job.polls, 1), Job.unanswered,
+    len(Latencies), ', worst latency %1.1f ms' % (max(Latencies) * 1000) if Latencies else ''
+  ))
+
+#==============================================================================
+# summarize how well a timeline kept to its deadlines
+#==============================================================================
+
+def ShowLateness(Job):
+  if not Job.lateness:
+    return
+  Sorted = sorted(Job.lateness)
+  Count = len(Sorted)
+  print('  %slateness: mean %1.1f ms, median %1.1f ms, 95%% %1.1f ms, max %1.1f ms over %d steps (%d over 1 ms)' % (
+    Job.prefix, sum(Sorted) * 1000 / Count, Sorted[Count // 2] * 1000,
+    Sorted[min(Count - 1, int(Count * 0.95))] * 1000, Sorted[-1] * 1000,
+    Count, len([Late for Late in Sorted if Late > 0.001])
+  ))
+
+#==============================================================================
+# compare the achieved period between groups of set-points, as acknowledged by
+# the supply, with the period requested, which tells the real bandwidth of
+# the waveform produced
+#==============================================================================
+
+def ShowPeriods(Job):
+  if len(Job.applied) < 2:
+    return
+  Requested = []
+  Achieved = []
+  for Index in range(1, len(Job.applied)):
+    Requested.append(Job.applied[Index][0] - Job.applied[Index-1][0])
+    Achieved.append(Job.applied[Index][1] - Job.applied[Index-1][1])
+  Lag = [Time - Deadline for Deadline, Time in Job.applied]
+  Mean = sum(Achieved) / len(Achieved)
+  print('  %sset-point period: requested %1.1f ms, achieved %1.1f ms (%1.1f to %1.1f ms), %1.1f set-points/s' % (
+    Job.prefix, sum(Requested) * 1000 / len(Requested), Mean * 1000,
+    min(Achieved) * 1000, max(Achieved) * 1000, 1.0 / max(Mean, 1e-6)
+  ))
+  print('  %sset-point lag: mean %1.1f ms, max %1.1f ms, issued %1.1f ms early' % (
+    Job.prefix, sum(Lag) * 1000 / len(Lag), max(Lag) * 1000, Job.lead * 1000
+  ))
+
+#==============================================================================
+# summarize how long sweep points took to settle
+#==============================================================================
+
+def ShowSettling(Job):
+  if not Job.settles:
+    return
+  Times = [Elapsed for Elapsed, Settled in Job.settles]
+  print('  %ssweep: %d points settled in mean %1.1f ms, max %1.1f ms, %1.3f seconds in all (%d reached the maximum dwell)' % (
+    Job.prefix, len(Times), sum(Times) * 1000 / len(Times), max(Times) * 1000,
+    Job.shift, len([Settled for Elapsed, Settled in Job.settles if not Settled])
+  ))
+
+#==============================================================================
+# sample a supply's measured output in the background, at a fixed rate, until
+# told to stop.  each sample is two short transactions, the measured output
+# and the cv/cc state, rather than a whole snapshot, interleaved with the
+# sequence's own writes by the supply's link lock.  if a sample runs long the
+# schedule slips rather than bunching up.
+#==============================================================================
+
+def Measure(Job):
+  Volts, Amps, Watts = Job.supply.measure()
+  Job.measured = [Volts, Amps, Watts, Job.supply.CVCC]
+
+def Sampler(Job, Stop):
+  Next = Now()
+  while not Stop.is_set():
+    try:
+      Measure(Job)
+      Job.samples += 1
+      Record(Now() - Time0)
+    except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError):
+      Job.missed += 1
+    Next += SampleInterval
+    Time = Now()
+    if Next < Time:
+      Next = Time
+    Stop.wait((Next - Time) / Speed)
 
 #==============================================================================
-# parse arguments and build token list.  each token is an [opcode,parameter]
-# tuple where the the parameter may be None
+# parse a command-line argument holding (possibly comma-separated) commands
+# into a job's token list.  each token is an [opcode,parameter] tuple where
+# the parameter may be None
 #==============================================================================
 
-SupplyIndex = 1
-SupplySerial = None
+def ParseCommands(Job, arg):
+  for a2 in TokenSplit(arg): # .split(','):
+    if a2 in ['on','off','bl+','bl-']:
+      Job.tokens.append([a2,None])
+    elif a2 == '[':
+      Job.depth += 1
+      Job.tokens.append([a2,None])
+    elif StartsWithAny(a2, [']='], 2):
+      Job.depth -= 1
+      ValidInteger(a2, 2)
+      Job.tokens.append([a2[:1],Integer])
+    elif StartsWithAny(a2, ['m='], 2):
+      ValidInteger(a2, 2)
+      Job.tokens.append([a2[:1], Integer])
+    elif StartsWithAny(a2, ['s='], 2):
+      ValidFloat(a2, 2)
+      Job.tokens.append([a2[:1], Float])
+    elif StartsWithAny(a2, ['c=','c+','c-','v=','v+','v-'], 2):
+      ValidFloat(a2, 2)
+      Job.tokens.append([a2[:2], Float])
+    elif a2.startswith('ramp='):
+      try:
+        Fields = a2[5:].split(':')
+        if len(Fields) == 4:
+          Fields.append('lin')
+        Ramp = (Fields[0], float(Fields[1]), float(Fields[2]), int(Fields[3]), Fields[4])
+        if len(Fields) > 5 or Ramp[0] not in ['v','c'] or Ramp[2] < 0.0 or Ramp[3] < 1 or Ramp[4] not in RampShapes:
+          raise ValueError
+      except (ValueError, IndexError):
+        ShowErrorToken(a2)
+      Job.tokens.append(['ramp', Ramp])
+    elif a2.startswith('sweep='):
+      try:
+        Fields = a2[6:].split(':')
+        Fields += ['0.01', '5'][max(0, len(Fields) - 3):]
+        Sweep = (Fields[0], float(Fields[1]), int(Fields[2]), float(Fields[3]), float(Fields[4]))
+        if len(Fields) > 5 or Sweep[0] not in ['v','c'] or Sweep[2] < 1 or Sweep[3] < 0.0 or Sweep[4] < 0.0:
+          raise ValueError
+      except (ValueError, IndexError):
+        ShowErrorToken(a2)
+      Job.tokens.append(['sweep', Sweep])
+    elif a2.startswith('wave='):
+      if len(a2) == 5:
+        ShowErrorToken(a2)
+      Job.tokens.append(['wave', a2[5:]])
+    elif a2.startswith('recall='):
+      ValidInteger(a2, 7)
+      if not 1 <= Integer <= 9:
+        ShowErrorToken(a2)
+      Job.tokens.append(['recall', Integer])
+    elif StartsWithAny(a2, ['ocp=','ovp='], 4):
+      ValidFloat(a2, 4)
+      Job.tokens.append([a2[:4], Float])
+    else:
+      ShowErrorToken(a2)
 
-Tokens = []
-Depth = 0
-for arg in sys.argv[1:]:
-  if arg.startswith('-'):
-    if Tokens:
-      ShowErrorToken(arg) # options must come before commands
+#==============================================================================
+# traverse a token list and 'fold' it into a hierarchical structure where
+# all sub-sequences are collected into a single * metacommand.
+#==============================================================================
+
+def FoldTokens(Tokens):
+  Sequence = []
+  Stack = [Sequence]
+  Starts = [0]
+  for Token in Tokens:
+    if Token[0] == '[':
+      Stack.append([])
+      Sequence.append(['*',Stack[-1]])
+      Starts.append(Sequence[-1])
+      Sequence = Stack[-1]
+    elif Token[0] == ']':
+      Stack.pop()
+      Start = Starts.pop()
+      Start[0] = '*%s' % (Token[1])
+      Sequence = Stack[-1]
     else:
-      if arg == '-h':
+      Sequence.append(Token)
+  return Stack[0]
+
+#==============================================================================
+# parse arguments into a list of jobs.  a -i= option following commands, or
+# following another -i= option, starts the sequence for another supply; all
+# other options must come before the first command.  options that configure
+# the link or the daemon itself are refused in requests made to a daemon.
+#==============================================================================
+
+DefaultSocketName = '/tmp/%s.sock' % (PROGRAM.split('.')[0])
+
+DaemonSocket = None
+ClientSocket = None
+
+def ParseArguments(Args):
+  global OutputFileName, SemaphoreFileName, SampleInterval, Simulate, Speed
+  global DaemonSocket, ClientSocket, Compensate, SpinWindow, WatchLimits
+  global PresetFileName, ShowPresets, Benchmark, SettleReadings, SettlePoll
+  SampleInterval = None
+  SettleReadings, SettlePoll = SettleDefaults
+  Benchmark = None
+  WatchLimits = None
+  PresetFileName = None
+  ShowPresets = False
+  Compensate = False
+  SpinWindow = 0.0
+  Jobs = [SupplyJob()]
+  for arg in Args:
+    if arg.startswith('-'):
+      if arg.startswith('-i='):
+        if Jobs[-1].tokens or Jobs[-1].selected:
+          Jobs.append(SupplyJob())
+        try:
+          Jobs[-1].selected = True
+          Jobs[-1].index = int(arg[3:])
+          if Jobs[-1].index > 99:
+            Jobs[-1].serial = Jobs[-1].index
+        except ValueError:
+          ShowErrorToken(arg)
+      elif Jobs[-1].tokens or len(Jobs) > 1:
+        ShowErrorToken(arg) # options must come before commands
+      elif arg == '-h':
         ShowHelp()
-      elif arg.startswith('-i='):
+      elif Serving and arg[:2] in ['-b','-c','-d','-t','-u']:
+        ShowError('the option %s cannot be sent to a running daemon' % (arg))
+      elif arg.startswith('-a='):
         try:
-          SupplyIndex = int(arg[3:])
-          if SupplyIndex > 99:
-            SupplySerial = SupplyIndex
-        except:
+          Values = arg[3:].split(',')
+          if len(Values) > 2:
+            ShowErrorToken(arg)
+          SettleReadings = int(Values[0])
+          if len(Values) > 1:
+            SettlePoll = int(Values[1]) / 1000.0
+          if SettleReadings < 1 or SettlePoll < 0.0:
+            ShowErrorToken(arg)
+        except ValueError:
           ShowErrorToken(arg)
+      elif arg == '-b' or arg.startswith('-b='):
+        Benchmark = 100
+        if arg.startswith('-b='):
+          ValidInteger(arg, 3)
+          if Integer < 1:
+            ShowErrorToken(arg)
+          Benchmark = Integer
+      elif arg == '-c' or arg.startswith('-c='):
+        ClientSocket = arg[3:] or DefaultSocketName
+      elif arg == '-u' or arg.startswith('-u='):
+        DaemonSocket = arg[3:] or DefaultSocketName
+      elif arg == '-d' or arg.startswith('-d='):
+        try:
+          Simulate = [10.0, 0.0, 1.0]
+          if arg.startswith('-d='):
+            Values = arg[3:].split(',')
+            if len(Values) > 3:
+              ShowErrorToken(arg)
+            for Index, Value in enumerate(Values):
+              Simulate[Index] = float(Value)
+          if Simulate[0] < 0.0 or not 0.0 <= Simulate[1] <= 100.0 or Simulate[2] <= 0.0:
+            ShowErrorToken(arg)
+          Speed = Simulate[2]
+        except ValueError:
+          ShowErrorToken(arg)
+      elif arg == '-l' or arg.startswith('-l='):
+        try:
+          Compensate = True
+          if arg.startswith('-l='):
+            SpinWindow = float(arg[3:]) / 1000.0
+            if SpinWindow < 0.0:
+              ShowErrorToken(arg)
+        except ValueError:
+          ShowErrorToken(arg)
+      elif arg.startswith('-w='):
+        WatchLimits = {}
+        for Limit in arg[3:].split(','):
+          if Limit == 'cc':
+            WatchLimits['cc'] = True
+          elif Limit[:1] in ['a','w','t','v'] and Limit[:1] not in WatchLimits:
+            try:
+              WatchLimits[Limit[:1]] = float(Limit[1:])
+            except ValueError:
+              ShowErrorToken(arg)
+          else:
+            ShowErrorToken(arg)
+      elif arg == '-m' or arg.startswith('-m='):
+        ShowPresets = True
+        if arg.startswith('-m='):
+          PresetFileName = arg[3:]
+          if not PresetFileName:
+            ShowErrorToken(arg)
       elif arg.startswith('-o='):
         try:
           OutputFileName = arg[3:]
@@ -535,104 +1736,231 @@ for arg in sys.argv[1:]:
             ShowErrorToken(arg)
           if not '.' in OutputFileName:
             OutputFileName += '.json'
-        except:
+        except ValueError:
+          ShowErrorToken(arg)
+      elif arg.startswith('-r='):
+        try:
+          SampleInterval = int(arg[3:]) / 1000.0
+          if SampleInterval <= 0.0:
+            ShowErrorToken(arg)
+        except ValueError:
           ShowErrorToken(arg)
       elif arg.startswith('-s='):
         try:
           SemaphoreFileName = arg[3:]
           if len(SemaphoreFileName) < 1:
             ShowErrorToken(arg)
-        except:
+        except ValueError:
+          ShowErrorToken(arg)
+      elif arg.startswith('-t='):
+        try:
+          Values = arg[3:].split(',')
+          if len(Values) > 4:
+            ShowErrorToken(arg)
+          Policy.attempts = int(Values[0])
+          if len(Values) > 1:
+            Policy.timeout = int(Values[1]) / 1000.0
+          if len(Values) > 2:
+            Policy.backoff = int(Values[2]) / 1000.0
+          if len(Values) > 3:
+            Policy.deadline = int(Values[3]) / 1000.0
+          if Policy.attempts < 1 or Policy.timeout <= 0.0:
+            ShowErrorToken(arg)
+        except ValueError:
           ShowErrorToken(arg)
       else:
         ShowErrorToken(arg)
-  else:
-    for a2 in TokenSplit(arg): # .split(','):
-      if a2 in ['on','off','bl+','bl-']:
-        Tokens.append([a2,None])
-      elif a2 == '[':
-        Depth += 1
-        Tokens.append([a2,None])
-      elif StartsWithAny(a2, [']='], 2):
-        Depth -= 1
-        ValidInteger(a2, 2)
-        Tokens.append([a2[:1],Integer])
-      elif StartsWithAny(a2, ['m='], 2):
-        ValidInteger(a2, 2)
-        Tokens.append([a2[:1], Integer])
-      elif StartsWithAny(a2, ['s='], 2):
-        ValidFloat(a2, 2)
-        Tokens.append([a2[:1], Float])
-      elif StartsWithAny(a2, ['c=','c+','c-','v=','v+','v-'], 2):
-        ValidFloat(a2, 2)
-        Tokens.append([a2[:2], Float])
-      elif StartsWithAny(a2, ['ocp=','ovp='], 4):
-        ValidFloat(a2, 4)
-        Tokens.append([a2[:4], Float])
-      else:
-        ShowErrorToken(a2)
-
-if not Depth == 0:
-  ShowError('mismatched [ and ] group indicators')
+    else:
+      ParseCommands(Jobs[-1], arg)
+  for Job in Jobs:
+    if not Job.depth == 0:
+      ShowError('mismatched [ and ] group indicators')
+  if Serving:
+    return Jobs
+  if DaemonSocket and ClientSocket:
+    ShowError('a daemon cannot also be its own client')
+  if DaemonSocket and any(Job.tokens for Job in Jobs):
+    ShowError('the daemon takes its commands from clients, not the command line')
+  if Benchmark and any(Job.tokens for Job in Jobs):
+    ShowError('a benchmark runs no sequence, so -b cannot be given commands')
+  return Jobs
 
 #==============================================================================
-# traverse the token list and 'fold' it into a hierarchical structure where
-# all sub-sequences are collected into a single * metacommand.
+# compile the sequences and show what they will do before touching a supply.
+# each sequence starts from its job's set-points, which are zero unless the
+# supply's state is already known.
 #==============================================================================
 
-Sequence = []
-Stack = [Sequence]
-Starts = [0]
-for Token in Tokens:
-  if Token[0] == '[':
-    Stack.append([])
-    Sequence.append(['*',Stack[-1]])
-    Starts.append(Sequence[-1])
-    Sequence = Stack[-1]
-  elif Token[0] == ']':
-    Stack.pop()
-    Start = Starts.pop()
-    Start[0] = '*%s' % (Token[1])
-    Sequence = Stack[-1]
-  else:
-    Sequence.append(Token)
-
-Sequence = Stack[0]
+def CompileJobs(Jobs):
+  for Job in Jobs:
+    Job.sequence = FoldTokens(Job.tokens)
+    State = {'time': 0.0, 'volts': Job.volts, 'amps': Job.amps}
+    SetPoints = 0
+    Job.steps = 0
+    for Step in CompileSequence(Job.sequence, 1, 1, State):
+      Job.steps += 1
+      if Step.command[0] in 'cv' or Step.command in ['sweep','recall']:
+        SetPoints += 1
+    Job.duration = State['time']
+    if len(Jobs) > 1:
+      Job.prefix = '#%d ' % (Jobs.index(Job) + 1)
+    if Job.steps:
+      print('  %ssequence of %d steps (%d set-points), lasting %1.3f seconds' % (
+        Job.prefix, Job.steps, SetPoints, Job.duration
+      ))
+  if any(Job.steps for Job in Jobs):
+    print()
 
 #==============================================================================
-# get access to a specific rd6006 programmable power supply
+# get access to the requested rd6006 programmable power supplies.  ports are
+# probed in parallel, with a short timeout, and the supplies found on them are
+# kept open for use rather than being opened a second time.  the port each
+# supply was last found on is remembered in a cache file, keyed by serial
+# number and checked against the port's usb hardware id, so that a supply
+# selected by serial number can usually be found by probing just one port.
+# a selected port that did not answer the quick probe gets one more try under
+# the full retry policy.
 #==============================================================================
 
-import serial.tools.list_ports
-
 Ports = []
+PortIds = {}
+Simulators = {}
+
+def FindPorts(Jobs):
+  if Simulate:
+    for Index, Job in enumerate(Jobs):
+      Port = 'sim:%d' % (Index + 1)
+      Ports.append(Port)
+      PortIds[Port] = Port
+      Simulators[Port] = SimulatedRD6006(serial=Job.serial or 10001 + Index,
+        latency=Simulate[0] / 1000.0, droprate=Simulate[1] / 100.0, speed=Speed)
+    print('  simulating %d power supplies (%d ms latency, %1.1f%% dropped, %1.1fx speed)' % (
+      len(Ports), Simulate[0], Simulate[1], Simulate[2]
+    ))
+  else:
+    for Port in list(serial.tools.list_ports.comports()):
+      if "VID:PID=1A86:7523" in Port[2]:
+        Ports.append(Port[0])
+        PortIds[Port[0]] = Port[2]
+    print('  found %d power supplies' % (len(Ports)))
+  if not len(Ports):
+    print()
+    print("*** unable to find a power supplies - is one plugged in and turned on?")
+    print()
+    os._exit(1)
 
-for Port in list(serial.tools.list_ports.comports()):
-  if "VID:PID=1A86:7523" in Port[2]:
-    Ports.append(Port[0])
+CacheFileName = os.path.expanduser('~/.%s-cache.json' % (PROGRAM.split('.')[0]))
 
-print('  found %d power supplies' % (len(Ports)))
-if not len(Ports):
-  print()
-  print("*** unable to find a power supplies - is one plugged in and turned on?")
-  print()
-  os._exit(1)
+ProbePolicy = RetryPolicy(attempts=2, timeout=0.2, backoff=0.01, deadline=0.5)
 
-for Index in range(len(Ports)):
-  with RD6006(Ports[Index]) as Supply:
-    if Supply.serial == SupplySerial:
-      SupplyIndex = Index+1
+def LoadCache():
+  try:
+    return json.load(open(CacheFileName))
+  except:
+    return {}
 
-if len(Ports) < SupplyIndex:
-  print()
-  print("*** power supply index %d out of range" % (SupplyIndex))
-  print()
-  os._exit(1)
+def SaveCache(Cache):
+  try:
+    with open(CacheFileName, 'w') as f:
+      f.write(json.dumps(Cache, indent=2))
+  except:
+    pass # the cache is only a shortcut
 
-try:
-  Supply = RD6006(Ports[SupplyIndex-1])
-  print('  found an rd%d at index %d (serial %s, firmware %s)' % (Supply.type, SupplyIndex, Supply.serial, Supply.firmware))
-except serial.serialutil.SerialException:
+def OpenSupply(Port, Policy):
+  return RD6006(Port, policy=Policy, instrument=Simulators.get(Port))
+
+def ProbeSupplies(PortList, Probed, Cache, Using=ProbePolicy):
+  Errors = []
+  def Probe(Port):
+    try:
+      Probed[Port] = OpenSupply(Port, Using)
+    except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError):
+      Probed[Port] = None
+    except serial.serialutil.SerialException as Error:
+      Errors.append(Error)
+  Threads = []
+  for Port in PortList:
+    if not Probed.get(Port):
+      Threads.append(threading.Thread(target=Probe, args=(Port,)))
+  for Thread in Threads:
+    Thread.start()
+  for Thread in Threads:
+    Thread.join()
+  if Errors:
+    raise Errors[0]
+  for Port in PortList:
+    Supply = Probed.get(Port)
+    if Supply:
+      Supply.use_policy(Policy)
+      Cache['%s' % (Supply.serial)] = {
+        'device': Port, 'hwid': PortIds[Port], 'type': Supply.type
+      }
+
+def FindSerial(Serial, Probed):
+  for Port in Probed:
+    if Probed[Port] and Probed[Port].serial == Serial:
+      return Port
+  return None
+
+def SelectSupplies(Jobs, Probed):
+  """points each job at its supply among those already probed"""
+  for Job in Jobs:
+    if Job.serial:
+      Port = FindSerial(Job.serial, Probed)
+      if not Port:
+        ShowSupplyError('power supply serial %d not found' % (Job.serial))
+      Job.index = Ports.index(Port) + 1
+    elif len(Ports) < Job.index:
+      ShowSupplyError('power supply index %d out of range' % (Job.index))
+  for Job in Jobs:
+    if [Other.index for Other in Jobs].count(Job.index) > 1:
+      ShowSupplyError('power supply index %d is given more than one sequence' % (Job.index))
+  for Job in Jobs:
+    Job.supply = Probed.get(Ports[Job.index-1])
+    if not Job.supply:
+      ShowSupplyError('no power supply responding at index %d (%s)' % (Job.index, Ports[Job.index-1]))
+    Job.name = '%s' % (Job.supply.serial)
+
+def OpenSupplies(Jobs, All=False):
+  """probes the ports the jobs need (or every port) and returns {port: RD6006}
+  for the supplies found, with the jobs pointed at theirs"""
+  Probed = {}
+  Cache = {}
+  if not Simulate:
+    Cache = LoadCache()
+  if All:
+    ProbeSupplies(Ports, Probed, Cache, Policy)
+  else:
+    Cached = []
+    for Job in Jobs:
+      if Job.serial:
+        Entry = Cache.get('%s' % (Job.serial))
+        if Entry and PortIds.get(Entry['device']) == Entry['hwid']:
+          Cached.append(Entry['device'])
+    ProbeSupplies(Cached, Probed, Cache)
+    if [Job for Job in Jobs if Job.serial and not FindSerial(Job.serial, Probed)]:
+      ProbeSupplies(Ports, Probed, Cache)
+    for Job in Jobs:
+      if Job.serial:
+        Port = FindSerial(Job.serial, Probed)
+        if Port:
+          Job.index = Ports.index(Port) + 1
+    ProbeSupplies([Ports[Job.index-1] for Job in Jobs if Job.index <= len(Ports)],
+      Probed, Cache, Policy)
+  if not Simulate:
+    SaveCache(Cache)
+  SelectSupplies(Jobs, Probed)
+  for Job in Jobs:
+    print('  found an rd%d at index %d (serial %s, firmware %s)' % (
+      Job.supply.type, Job.index, Job.supply.serial, Job.supply.firmware
+    ))
+  if not All:
+    for Port in Probed:
+      if Probed[Port] and not Probed[Port] in [Job.supply for Job in Jobs]:
+        Probed[Port].close()
+  return Probed
+
+def ShowPermissionHelp():
   print("*** you don't have permission to use the serial/usb port.  to fix this")
   print('*** sad state of affairs, do the following:')
   print()
@@ -646,31 +1974,486 @@ except serial.serialutil.SerialException:
   print()
   os._exit(1)
 
-print()
-if Tokens:
+#==============================================================================
+# run the sequences, one worker thread per supply (plus, when sampling, one
+# sampler thread per supply), all on the same clock
+#==============================================================================
+
+def RunJobs(Jobs):
+  global Time0
+  for Job in Jobs:
+    print('executing %ssequence of %d commands on supply %s' % (Job.prefix, len(Job.tokens), Job.name))
+  print()
+  print('  step/steps          secs   volts    amps  late ms  command')
+  print('  ---------------  -------  ------  ------  -------  ---------')
+  Stop = threading.Event()
+  Watchdogs = []
+  Samplers = []
+  Workers = []
+  try:
+    if SampleInterval:
+      for Job in Jobs:
+        Measure(Job)
+  except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError):
+    pass # the sampler will catch up
+  for Job in Jobs:
+    if [Token for Token in Job.tokens if Token[0] == 'recall']:
+      Job.presets = Job.supply.presets()
+  if Compensate:
+    for Job in Jobs:
+      Job.lead = Job.supply.calibrate() * Speed
+      print('  %swrite round trip %1.1f ms, set-points will be issued that much early' % (
+        Job.prefix, Job.lead * 1000
+      ))
+    print()
+  Time0 = Now()
+  for Job in Jobs:
+    if SampleInterval:
+      Samplers.append(threading.Thread(target=Sampler, args=(Job, Stop), daemon=True))
+    if WatchLimits:
+      Watchdogs.append(threading.Thread(target=Watchdog, args=(Job, Stop), daemon=True))
+    Workers.append(threading.Thread(target=RunJob, args=(Job,), daemon=True))
+  for Thread in Watchdogs + Samplers + Workers:
+    Thread.start()
+  for Thread in Workers:
+    Thread.join()
+  Stop.set()
+  for Thread in Watchdogs + Samplers:
+    Thread.join()
+  Elapsed = Now() - Time0
+  print()
+  for Job in Jobs:
+    if SampleInterval:
+      print('  %ssampler: %d samples every %d ms requested, %1.1f ms achieved, %d missed' % (
+        Job.prefix, Job.samples, SampleInterval * 1000,
+        Elapsed * 1000 / max(Job.samples, 1), Job.missed
+      ))
+    ShowLateness(Job)
+    ShowPeriods(Job)
+    ShowSettling(Job)
+    ShowWatchdog(Job, Elapsed)
+  print()
+  print('  sequence took %1.3f seconds, %1.3f seconds real time' % (
+    Elapsed, Elapsed / Speed
+  ))
+
+#==============================================================================
+# upload memory presets from a csv file, one preset per line as: slot,volts,
+# amps,ovp,ocp (skipping blank lines, lines starting with # and a heading on
+# the first line), then show the presets.  the presets are read in one
+# transaction, and those in the file are patched in and written back, from
+# the first slot changed to the last, in another.
+#==============================================================================
+
+PresetFileName = None
+ShowPresets = False
+
+def ReadPresetFile(FileName):
+  Uploads = {}
+  try:
+    with open(FileName) as File:
+      for Number, Line in enumerate(File, 1):
+        Fields = [Field.strip() for Field in Line.split(',')]
+        if not Fields[0] or Fields[0].startswith('#'):
+          continue
+        try:
+          Slot = int(Fields[0])
+          if len(Fields) != 5 or not 0 <= Slot <= 9:
+            raise ValueError
+          Uploads[Slot] = Preset(*[float(Field) for Field in Fields[1:]])
+        except ValueError:
+          if Number == 1:
+            continue
+          ShowError("line %d of preset file '%s' could not be parsed" % (Number, FileName))
+  except OSError as Error:
+    ShowError("preset file '%s' could not be read (%s)" % (FileName, Error.strerror))
+  return Uploads
+
+def RunPresets(Jobs):
+  Uploads = {}
+  if PresetFileName:
+    Uploads = ReadPresetFile(PresetFileName)
+  for Job in Jobs:
+    Presets = Job.supply.presets()
+    if Uploads:
+      for Slot in Uploads:
+        Presets[Slot] = Uploads[Slot]
+      First = min(Uploads)
+      Job.supply.upload_presets(Presets[First:max(Uploads) + 1], First)
+      print('  %suploaded %d presets to supply %s' % (Job.prefix, len(Uploads), Job.name))
+    print()
+    print('  %smemory presets of supply %s:' % (Job.prefix, Job.name))
+    print()
+    for Slot, Values in enumerate(Presets):
+      print('    M%d: %6.2fV %6.3fA  ovp %6.2fV  ocp %6.3fA' % ((Slot,) + tuple(Values)))
+  print()
+
+#==============================================================================
+# characterize the modbus link to each supply: the latency of reads of one up
+# to 42 contiguous registers, of writes of one and two registers (rewriting
+# the voltage and current set-points with their own values, so the output
+# does not change), and of single reads under a range of timeouts.  on a dry
+# run the simulated link is also swept over the standard baud rates, which a
+# real supply only changes from its front panel.  each case is repeated
+# Benchmark times, and the report holds latency percentiles, throughput and
+# the retries taken, from which batching and timeouts can be chosen.
+#==============================================================================
+
+Benchmark = None # repeats of each case
+
+BenchmarkBlocks = [1, 2, 4, 8, 16, 32, 42]
+BenchmarkTimeouts = [0.02, 0.05, 0.1, 0.2, 0.5]
+BenchmarkBaudRates = [9600, 19200, 38400, 57600, 115200]
+
+def BenchmarkCase(Supply, Case, Registers, Transaction):
+  Supply.stats = {}
+  Latencies = []
+  Start = Now()
+  for Repeat in range(Benchmark):
+    Began = Now()
+    try:
+      Transaction()
+    except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError):
+      continue
+    Latencies.append(Now() - Began)
+  Elapsed = Now() - Start
+  Sorted = sorted(Latencies) or [0.0]
+  Count = len(Sorted)
+  Stats = list(Supply.stats.values())
+  Result = {
+    'case'        : Case,
+    'registers'   : Registers,
+    'baudrate'    : Supply.instrument.serial.baudrate,
+    'timeout_ms'  : Supply.policy.timeout * 1000,
+    'transactions': Benchmark,
+    'latency_ms'  : {
+      'mean': sum(Sorted) * 1000 / Count,
+      'p50' : Sorted[Count // 2] * 1000,
+      'p90' : Sorted[min(Count - 1, int(Count * 0.90))] * 1000,
+      'p99' : Sorted[min(Count - 1, int(Count * 0.99))] * 1000,
+      'max' : Sorted[-1] * 1000
+    },
+    'transactions_per_s': len(Latencies) / Elapsed,
+    'registers_per_s'   : len(Latencies) * Registers / Elapsed,
+    'retries'     : sum(Item['retries'] for Item in Stats),
+    'failures'    : sum(Item['failures'] for Item in Stats)
+  }
+  print('  %-6s %3d  %6d  %5d  %7.1f  %7.1f  %7.1f  %7.1f  %7.1f  %7.1f  %5d  %5d' % (
+    Case, Registers, Result['baudrate'], Result['timeout_ms'],
+    Result['latency_ms']['mean'], Result['latency_ms']['p50'], Result['latency_ms']['p90'],
+    Result['latency_ms']['p99'], Result['latency_ms']['max'], Result['transactions_per_s'],
+    Result['retries'], Result['failures']
+  ))
+  return Result
+
+def BenchmarkSupply(Supply):
+  Results = []
+  SetPoints = Supply._read_registers(8, 2)
+  for Registers in BenchmarkBlocks:
+    Results.append(BenchmarkCase(Supply, 'read', Registers,
+      lambda: Supply._read_registers(0, Registers)))
+  Results.append(BenchmarkCase(Supply, 'write', 1,
+    lambda: Supply._write_register(8, SetPoints[0])))
+  Results.append(BenchmarkCase(Supply, 'write', 2,
+    lambda: Supply._write_registers(8, SetPoints)))
+  Using = Supply.policy
+  try:
+    for Timeout in BenchmarkTimeouts:
+      Supply.use_policy(RetryPolicy(Using.attempts, Timeout, Using.backoff, Using.deadline))
+      Results.append(BenchmarkCase(Supply, 'read', 1,
+        lambda: Supply._read_registers(0, 1)))
+  finally:
+    Supply.use_policy(Using)
+  if Simulate:
+    Serial = Supply.instrument.serial
+    Original = Serial.baudrate
+    try:
+      for BaudRate in BenchmarkBaudRates:
+        Serial.baudrate = BaudRate
+        for Registers in [1, BenchmarkBlocks[-1]]:
+          Results.append(BenchmarkCase(Supply, 'read', Registers,
+            lambda: Supply._read_registers(0, Registers)))
+    finally:
+      Serial.baudrate = Original
+  Supply.stats = {}
+  return Results
+
+def RunBenchmark(Jobs):
+  Report = {'repeats': Benchmark, 'simulated': bool(Simulate), 'supplies': []}
+  for Job in Jobs:
+    print('benchmarking supply %s, %d transactions per case' % (Job.name, Benchmark))
+    print()
+    print('  case   regs    baud  tmout     mean      p50      p90      p99      max    per s  retry   fail')
+    print('  -----  ---  ------  -----  -------  -------  -------  -------  -------  -------  -----  -----')
+    Report['supplies'].append({
+      'serial'  : Job.supply.serial,
+      'firmware': Job.supply.firmware,
+      'results' : BenchmarkSupply(Job.supply)
+    })
+    print()
+  return Report
+
+def WriteReport(Report):
+  if OutputFileName:
+    with open(OutputFileName, 'w') as f:
+      f.write(json.dumps(Report, indent=2))
+    print('done - wrote the benchmark report to %s' % (OutputFileName))
+  else:
+    print('done')
+  print()
+
+#==============================================================================
+# report how much the modbus link needed retrying
+#==============================================================================
+
+def ShowRetryStats(Job):
+  Stats = Job.supply.retry_stats()
+  Totals = [0, 0, 0, 0.0]
+  for Register in Stats:
+    Totals[0] += Stats[Register]['transactions']
+    Totals[1] += Stats[Register]['retries'     ]
+    Totals[2] += Stats[Register]['failures'    ]
+    Totals[3] += Stats[Register]['retrytime'   ]
+  print()
+  print('  %smodbus: %d transactions, %d retries, %d failures, %1.1f ms retrying (%s)' % (
+    Job.prefix, Totals[0], Totals[1], Totals[2], Totals[3] * 1000, Policy
+  ))
+  if Totals[1] or Totals[2]:
+    print()
+    print('  register  transactions  retries  failures  retry ms')
+    print('  --------  ------------  -------  --------  --------')
+    for Register in sorted(Stats):
+      if Stats[Register]['retries'] or Stats[Register]['failures']:
+        print('  %8d  %12d  %7d  %8d  %8.1f' % (Register,
+          Stats[Register]['transactions'], Stats[Register]['retries'],
+          Stats[Register]['failures'], Stats[Register]['retrytime'] * 1000
+        ))
+
+#==============================================================================
+# the dataset written to (or, from a daemon, returned for) the output file
+#==============================================================================
+
+def MakeDataSet():
+  OutputSet.sort(key=lambda Item: Item['time'])
+  DataSet = {
+    'channels': Channels(),
+    'data'    : OutputSet
+  }
+  if SweepSet:
+    DataSet['iv'] = {
+      'channels': Channels(SweepChannels),
+      'data'    : SweepSet
+    }
+  return DataSet
+
+#==============================================================================
+# write the output file.  the settled points of any sweeps go to a second file
+# alongside it, named with an -iv suffix
+#==============================================================================
+
+def WriteDataSet(DataSet):
+  print()
+  if OutputFileName:
+    Sweeps = DataSet.pop('iv', None)
+    with open(OutputFileName, 'w') as f:
+      f.write(json.dumps(DataSet, indent=2))
+    print('done - wrote %d sample sets to %s' % (len(DataSet['data']), OutputFileName))
+    if Sweeps:
+      Base, Extension = os.path.splitext(OutputFileName)
+      SweepFileName = '%s-iv%s' % (Base, Extension)
+      with open(SweepFileName, 'w') as f:
+        f.write(json.dumps(Sweeps, indent=2))
+      print('       wrote %d sweep points to %s' % (len(Sweeps['data']), SweepFileName))
+  else:
+    print('done')
+  print()
+
+def WaitForSemaphore():
   if SemaphoreFileName:
     print("waiting for semaphore file '%s' to appear..." % (SemaphoreFileName))
     while not os.path.exists(SemaphoreFileName):
       time.sleep(0.2)
     print()
-  print('executing sequence of %d commands:' % (len(Tokens)))
-  print()
-  RunSequence(Sequence, 1, 1)
-else:
-  print('no commands, nothing to do (ask for help with -h)')
 
-print()
-if OutputFileName:
-  with open(OutputFileName, 'w') as f:
-    DataSet = {
-      'channels': ['volts','amps'],
-      'data'    : OutputSet
-    }
-    f.write(json.dumps(DataSet, indent=2))
-  print('done - wrote %d sample sets to %s' % (len(OutputSet), OutputFileName))
-else:
+#==============================================================================
+# the daemon keeps its supplies open and runs sequences sent to it over a unix
+# domain socket, so a client pays only for a socket round trip rather than for
+# startup, imports and probing.  the protocol is one json object per line: the
+# client sends {"args": [...]}, holding its command line less the options it
+# handles itself, and the daemon answers with any number of {"print": "..."}
+# objects carrying the run's console output, then either {"dataset": {...}}
+# or {"error": "..."}, which the client shows unless it is empty, as after
+# the help text.  sequences start from each supply's actual set-points,
+# read when the request arrives.  requests are served one at a time.
+#==============================================================================
+
+class SocketWriter:
+  def __init__(self, Connection):
+    self.connection = Connection
+    self.lock = threading.Lock()
+
+  def send(self, Message):
+    with self.lock:
+      self.connection.sendall((json.dumps(Message) + '\n').encode())
+
+  def write(self, Text):
+    if Text:
+      self.send({'print': Text})
+
+  def flush(self):
+    pass
+
+def HandleRequest(Args, Probed):
+  global Serving, CommandLine, Jobs, OutputSet, SweepSet
+  Serving = True
+  CommandLine = [PROGRAM] + Args
+  try:
+    Jobs = ParseArguments(Args)
+    SelectSupplies(Jobs, Probed)
+    for Job in Jobs:
+      Sample = Job.supply.snapshot()
+      Job.volts = Sample.voltage
+      Job.amps = Sample.current
+      Job.supply.stats = {}
+    CompileJobs(Jobs)
+    OutputSet = []
+    SweepSet = []
+    if ShowPresets:
+      RunPresets(Jobs)
+    if any(Job.tokens for Job in Jobs):
+      RunJobs(Jobs)
+    for Job in Jobs:
+      ShowRetryStats(Job)
+    return MakeDataSet()
+  finally:
+    Serving = False
+    CommandLine = sys.argv
+
+def SendError(Writer, Message):
+  try:
+    Writer.send({'error': Message})
+  except OSError:
+    print('  *** lost client, which was not told: %s' % (Message))
+
+def Serve(SocketName, Probed):
+  import socket
+  if os.path.exists(SocketName):
+    os.unlink(SocketName)
+  Server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  Server.bind(SocketName)
+  Server.listen(4)
+  print()
+  print("serving sequences on '%s' (^c to stop)" % (SocketName))
+  try:
+    while True:
+      Connection, Address = Server.accept()
+      with Connection:
+        Writer = SocketWriter(Connection)
+        try:
+          Request = json.loads(Connection.makefile('r').readline())
+          print('  request: %s' % (' '.join(Request['args'])))
+          with contextlib.redirect_stdout(Writer):
+            DataSet = HandleRequest(Request['args'], Probed)
+          Writer.send({'dataset': DataSet})
+        except RequestError as Error:
+          SendError(Writer, '%s' % (Error))
+        except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError) as Error:
+          print('  *** a power supply stopped responding (%s)' % (Error))
+          SendError(Writer, 'a power supply stopped responding (%s)' % (Error))
+        except (OSError, ValueError, KeyError, TypeError) as Error:
+          print('  *** bad request or lost client (%s)' % (Error))
+  except KeyboardInterrupt:
+    print()
+  finally:
+    Server.close()
+    os.unlink(SocketName)
+    for Port in Probed:
+      if Probed[Port]:
+        Probed[Port].close()
   print('done')
+  print()
+
+def RunClient(SocketName, Args):
+  import socket
+  Forward = []
+  for arg in Args:
+    if not (arg == '-c' or arg[:3] in ['-c=','-o=','-s=']):
+      Parts = arg.split(',')
+      for Index, Part in enumerate(Parts): # wave files are read by the daemon
+        Head, Wave, FileName = Part.partition('wave=')
+        if Wave and not Head.strip('['):
+          Parts[Index] = Head + Wave + os.path.abspath(FileName)
+      if arg.startswith('-m='):
+        Parts = ['-m=' + os.path.abspath(arg[3:])]
+      Forward.append(','.join(Parts))
+  WaitForSemaphore()
+  try:
+    Connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    Connection.connect(SocketName)
+  except OSError:
+    print("*** no daemon is listening on '%s' - start one with -u" % (SocketName))
+    print()
+    os._exit(1)
+  with Connection:
+    Connection.sendall((json.dumps({'args': Forward}) + '\n').encode())
+    for Line in Connection.makefile('r'):
+      Message = json.loads(Line)
+      if 'print' in Message:
+        sys.stdout.write(Message['print'])
+      elif 'dataset' in Message:
+        return Message['dataset']
+      elif 'error' in Message:
+        if Message['error']:
+          print('*** the daemon could not run the request: %s' % (Message['error']))
+          print()
+        os._exit(1)
+  print('*** the daemon went away')
+  print()
+  os._exit(1)
+
+#==============================================================================
+# do it
+#==============================================================================
+
+Jobs = ParseArguments(sys.argv[1:])
+
+if ClientSocket:
+  WriteDataSet(RunClient(ClientSocket, sys.argv[1:]))
+  os._exit(0)
+
+CompileJobs(Jobs)
+
+ImportModbus()
+import serial.tools.list_ports
+
+try:
+  FindPorts(Jobs)
+  Probed = OpenSupplies(Jobs, All=DaemonSocket and not any(Job.selected for Job in Jobs))
+except serial.serialutil.SerialException:
+  ShowPermissionHelp()
+
+if Benchmark:
+  print()
+  WriteReport(RunBenchmark(Jobs))
+  os._exit(0)
+
+if DaemonSocket:
+  Serve(DaemonSocket, Probed)
+  os._exit(0)
+
 print()
+if ShowPresets:
+  RunPresets(Jobs)
+if any(Job.tokens for Job in Jobs):
+  WaitForSemaphore()
+  RunJobs(Jobs)
+elif not ShowPresets:
+  print('no commands, nothing to do (ask for help with -h)')
+
+for Job in Jobs:
+  ShowRetryStats(Job)
+
+WriteDataSet(MakeDataSet())
 
 #==============================================================================
 # end
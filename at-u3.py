@@ -7,10 +7,10 @@
 #==============================================================================
 
 PROGRAM = 'at-u3.py'
-VERSION = '2.103.101'
+VERSION = '2.111.101'
 CONTACT = 'bright.tiger@mail.com' # michael nagy
 
-import os, sys, time, json
+import os, sys, time, json, heapq, bisect, struct, itertools, threading, collections
 from pathlib import Path
 
 print()
@@ -42,6 +42,16 @@ except:
 '''))
   os._exit(1)
 
+#==============================================================================
+# numpy is optional: with it, readings are calibrated in whole batches, and
+# without it, one at a time
+#==============================================================================
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 #==============================================================================
 # default values
 #==============================================================================
@@ -50,6 +60,21 @@ InputCount =   4
 LoopCount  =  10
 LoopDelay  = 100
 
+OverrunPolicies      = ('skip', 'catchup', 'stretch')
+DefaultOverrunPolicy = 'skip' # when a polled scan runs past its deadline
+OverrunPolicy        = None
+
+StreamRate       = None # scans per second, when streaming
+StreamResolution = 3    # 0-3, higher is slower and less noisy
+StreamPacket     = 25   # samples per packet, 1-25
+
+Filters    = ('boxcar', 'ema', 'median')
+
+# AINs that fit in one feedback command, along with DAC0_8 and PortStateRead
+MaxFeedbackConversions = 18
+MaxStreamConversions   = 25 # channels in a stream scan list
+Decimation = None # store one scan in this many
+
 DefaultOutputFileName    = '%s-output.json' % (PROGRAM.split('.')[0])
 DefaultSemaphoreFileName = '%s.go'          % (PROGRAM.split('.')[0])
 
@@ -92,7 +117,7 @@ def ShowHelp():
 
 usage:
 
-    %s [-h] [-n=1..12] [-t=###] [-l=###]
+    %s [-h] [-n=1..12] [-t=###] [-l=###] [-r=###] [-p=policy] [-d=###]
       [-s=filename] [-c=filename[.json]] [-o=filename[.json]]
 
 where:
@@ -101,12 +126,55 @@ where:
     -n=# . . . . . number of inputs to scan (default %d, range 1..12)
     -t=# . . . . . time between sample loops (milliseconds, default %d)
     -l=# . . . . . number of sample loops (default %d)
+    -r=# . . . . . stream at this many scans per second instead (optional)
+    -p=xxxxx . . . overrun policy, skip, catchup or stretch (default '%s')
+    -d=# . . . . . store one scan in this many (default 1)
     -s=xxxxx . . . name of semaphore file (default '%s')
     -c=xxxxx . . . name of config file (optional)
     -o=xxxxx . . . name of output file (default '%s')
+
+in stream mode the u3 paces the scans itself, from its own clock, and sends
+them in packets, so that sample rates of thousands of scans per second are
+possible.  the loop count is then the number of scans to record, and the
+time of each scan is its position in the stream.  stream mode can also be
+selected by the config file, whose "stream" section may give the "rate",
+the "resolution" (0-3, default %d) and the "samples" per packet (1-25,
+default %d).
+
+when polling, each scan has a deadline, a whole number of loop delays after
+the first, kept by a monotonic clock, and each scan records the time it was
+actually taken.  a scan that runs past the next deadline is an overrun, and
+the overrun policy decides what follows: skip drops the deadlines already
+missed and carries on at the next, catchup takes the missed scans back to
+back until it is on schedule again, and stretch moves every later deadline
+back by the overrun.  the policy may also be given as "overrun" in the
+config file's "loop" section.  at the end of the run the jitter, how late
+each scan was against its deadline, and the deadlines missed are shown and
+written beside the output file, as xxxxx-timing.json.
+
+to read more inputs than one u3 has, the config file may have a "devices"
+section in place of "channels", listing several u3s, each with its
+"serial" number and its own "channels", up to 12.  each u3 is read by a
+thread of its own, against a clock they all share, so that polled scans
+have the same deadlines on every device.  the dataset has every device's
+channels, in order, and a sample set each time any device takes a scan,
+holding the latest scan from each, with the "times" those were taken.
+
+to acquire fast for noise rejection but store less, each channel in the
+config file may have an "oversample" count, of conversions made for it in
+each scan and averaged into one reading, and a "filter", one of "boxcar"
+(the mean of the last "window" readings), "ema" (an exponential moving
+average over about "window" readings) or "median" (the median of the last
+"window" readings), applied reading by reading as the scans arrive.  then
+only one scan in every -d, or "decimate" in the config file's "loop"
+section, is stored, the last of each run, so that its filtered values take
+in the scans between.  the loop count is still the number of scans taken.
+a u3's conversions in a scan, counting each oversampled one, must fit in
+one feedback command, at most %d, or in one stream scan list, at most %d.
 '''
   print(HelpText % (sys.argv[0],
-    InputCount, LoopDelay, LoopCount, DefaultSemaphoreFileName, DefaultOutputFileName))
+    InputCount, LoopDelay, LoopCount, DefaultOverrunPolicy, DefaultSemaphoreFileName, DefaultOutputFileName,
+    StreamResolution, StreamPacket, MaxFeedbackConversions, MaxStreamConversions))
   os._exit(1)
 
 #==============================================================================
@@ -139,6 +207,24 @@ for arg in sys.argv[1:]:
           ShowErrorToken(arg)
       except:
         ShowErrorToken(arg)
+    elif arg.startswith('-r='):
+      try:
+        StreamRate = float(arg[3:])
+        if StreamRate <= 0.0:
+          ShowErrorToken(arg)
+      except:
+        ShowErrorToken(arg)
+    elif arg.startswith('-p='):
+      OverrunPolicy = arg[3:]
+      if OverrunPolicy not in OverrunPolicies:
+        ShowErrorToken(arg)
+    elif arg.startswith('-d='):
+      try:
+        Decimation = int(arg[3:])
+        if Decimation < 1:
+          ShowErrorToken(arg)
+      except:
+        ShowErrorToken(arg)
     elif arg.startswith('-s='):
       try:
         SemaphoreFileName = arg[3:]
@@ -168,6 +254,90 @@ for arg in sys.argv[1:]:
   else:
     ShowErrorToken(arg)
 
+#==============================================================================
+# filters, which smooth a channel's readings one at a time, keeping just the
+# state they need from one to the next, so that they work the same however
+# the readings are batched.  each update() takes a reading and returns the
+# filtered value.
+#==============================================================================
+
+class BoxcarFilter:
+  def __init__(self, window):
+    self.readings = collections.deque(maxlen=window)
+    self.total = 0.0
+
+  def update(self, value):
+    if len(self.readings) == self.readings.maxlen:
+      self.total -= self.readings[0]
+    self.readings.append(value)
+    self.total += value
+    return self.total / len(self.readings)
+
+class EMAFilter:
+  def __init__(self, window):
+    self.alpha = 2.0 / (window + 1)
+    self.value = None
+
+  def update(self, value):
+    if self.value is None:
+      self.value = value
+    else:
+      self.value += self.alpha * (value - self.value)
+    return self.value
+
+class MedianFilter:
+  def __init__(self, window):
+    self.readings = collections.deque(maxlen=window)
+    self.ordered = [] # the same readings, kept sorted
+
+  def update(self, value):
+    if len(self.readings) == self.readings.maxlen:
+      del self.ordered[bisect.bisect_left(self.ordered, self.readings[0])]
+    self.readings.append(value)
+    bisect.insort(self.ordered, value)
+    Middle = len(self.ordered) // 2
+    if len(self.ordered) % 2:
+      return self.ordered[Middle]
+    return (self.ordered[Middle - 1] + self.ordered[Middle]) / 2.0
+
+def MakeFilter(Kind, Window):
+  if Kind == 'boxcar':
+    return BoxcarFilter(Window)
+  if Kind == 'ema':
+    return EMAFilter(Window)
+  if Kind == 'median':
+    return MedianFilter(Window)
+  return None
+
+#==============================================================================
+# each u3 acquired from, and its state.  its channels are a block of the
+# dataset's, count long from first, and its serial number is None when it is
+# simply the first u3 found.
+#==============================================================================
+
+class U3Device:
+  def __init__(self, serial, first, count):
+    self.serial = serial
+    self.first = first
+    self.count = count
+    self.oversample = ChannelOversample[first:first + count]
+    self.width = sum(self.oversample) # conversions in a scan
+    self.filters = [MakeFilter(*ChannelFilter[Input]) for Input in range(first, first + count)]
+    self.scans = 0     # scans drained, counting those not stored
+    self.labjack = None
+    self.feedback = [] # the feedback command for one scan, when polling
+    self.gain = []
+    self.bias = []
+    self.ring = None
+    self.times = []    # of the scans recorded
+    self.rows = []     # of calibrated values, one per scan recorded
+    self.latest = None # the last scan drained, for the display
+    self.lateness = [] # of each polled scan past its deadline, in seconds
+    self.missed = 0    # deadlines skipped, or taken a whole loop delay or more late
+    self.stream = {'missed': 0, 'errors': 0, 'backlog': 0}
+
+Devices = []
+
 #==============================================================================
 # load configuration from file if available
 #==============================================================================
@@ -176,37 +346,67 @@ ChannelName   = []
 ChannelTare   = []
 ChannelScale  = []
 ChannelOffset = []
+ChannelOversample = []
+ChannelFilter = [] # (kind, window), or (None, None)
 DisplayValues = []
 
+def LoadChannels(Channels, Key):
+  """appends a block of channels from the config, and returns its length"""
+  try:
+    for Channel in Channels:
+      Input = len(ChannelName)
+      if 'name' in Channel:
+        ChannelName.append(Channel['name'])
+      else:
+        if 'note' in Channel:
+          ChannelName.append(Channel['note'])
+        else:
+          ChannelName.append('input-%d' % (Input))
+      if 'tare' in Channel:
+        ChannelTare.append(Channel['tare'])
+      else:
+        ChannelTare.append(0.0)
+      if 'scale' in Channel:
+        ChannelScale.append(Channel['scale'])
+      else:
+        ChannelScale.append(1.0)
+      if 'offset' in Channel:
+        ChannelOffset.append(Channel['offset'])
+      else:
+        ChannelOffset.append(0.0)
+      Oversample = int(Channel.get('oversample', 1))
+      if Oversample < 1:
+        raise ValueError
+      ChannelOversample.append(Oversample)
+      if 'filter' in Channel:
+        Window = int(Channel.get('window', 1))
+        if Channel['filter'] not in Filters or Window < 1:
+          raise ValueError
+        ChannelFilter.append((Channel['filter'], Window))
+      else:
+        ChannelFilter.append((None, None))
+      DisplayValues.append(0.0)
+    return len(Channels)
+  except:
+    ShowErrorConfig(Key)
+
 if ConfigFileName:
   try:
     Config = json.load(open(ConfigFileName))
-    if 'channels' in Config:
+    if 'devices' in Config:
       try:
-        for Input, Channel in enumerate(Config['channels']):
-          if 'name' in Channel:
-            ChannelName.append(Channel['name'])
-          else:
-            if 'note' in Channel:
-              ChannelName.append(Channel['note'])
-            else:
-              ChannelName.append('input-%d' % (Input))
-          if 'tare' in Channel:
-            ChannelTare.append(Channel['tare'])
-          else:
-            ChannelTare.append(0.0)
-          if 'scale' in Channel:
-            ChannelScale.append(Channel['scale'])
-          else:
-            ChannelScale.append(1.0)
-          if 'offset' in Channel:
-            ChannelOffset.append(Channel['offset'])
-          else:
-            ChannelOffset.append(0.0)
-          DisplayValues.append(0.0)
-        InputCount = len(Config['channels'])
+        for Entry in Config['devices']:
+          Count = LoadChannels(Entry['channels'], 'devices')
+          if not 1 <= Count <= 12:
+            raise ValueError
+          Devices.append(U3Device(int(Entry['serial']), len(ChannelName) - Count, Count))
+        if not Devices or len(set(Device.serial for Device in Devices)) < len(Devices):
+          raise ValueError
       except:
-        ShowErrorConfig('channels')
+        ShowErrorConfig('devices')
+      InputCount = len(ChannelName)
+    elif 'channels' in Config:
+      InputCount = LoadChannels(Config['channels'], 'channels')
     if 'outputfile' in Config:
       OutputFileName = Config['outputfile']
     if 'loop' in Config:
@@ -220,17 +420,57 @@ if ConfigFileName:
           LoopCount = Config['loop']['count']
       except:
         ShowErrorConfig('loop.count')
+      if 'decimate' in Config['loop'] and not Decimation:
+        try:
+          Decimation = int(Config['loop']['decimate'])
+          if Decimation < 1:
+            raise ValueError
+        except:
+          ShowErrorConfig('loop.decimate')
+      if 'overrun' in Config['loop'] and not OverrunPolicy:
+        OverrunPolicy = Config['loop']['overrun']
+        if OverrunPolicy not in OverrunPolicies:
+          ShowErrorConfig('loop.overrun')
+    if 'stream' in Config:
+      try:
+        if not StreamRate:
+          StreamRate = float(Config['stream']['rate'])
+        if 'resolution' in Config['stream']:
+          StreamResolution = int(Config['stream']['resolution'])
+        if 'samples' in Config['stream']:
+          StreamPacket = int(Config['stream']['samples'])
+        if StreamRate <= 0.0 or not 0 <= StreamResolution <= 3 or not 1 <= StreamPacket <= 25:
+          raise ValueError
+      except:
+        ShowErrorConfig('stream')
   except:
     ShowError("config file '%s' not found" % (ConfigFileName))
 
+if not OverrunPolicy:
+  OverrunPolicy = DefaultOverrunPolicy
+
 if not ChannelName:
   for Input in range(0, InputCount):
     ChannelName  .append('input-%d' % (Input))
     ChannelTare  .append(0.0)
     ChannelScale .append(1.0)
     ChannelOffset.append(0.0)
+    ChannelOversample.append(1)
+    ChannelFilter.append((None, None))
     DisplayValues.append(0.0)
 
+if not Decimation:
+  Decimation = 1
+
+if not Devices:
+  Devices.append(U3Device(None, 0, InputCount))
+
+for Device in Devices:
+  if Device.width > (MaxStreamConversions if StreamRate else MaxFeedbackConversions):
+    if Device.serial:
+      ShowErrorConfig('devices.channels.oversample')
+    ShowErrorConfig('channels.oversample')
+
 #==============================================================================
 # show the active option values
 #==============================================================================
@@ -242,40 +482,383 @@ if ConfigFileName:
   print('          tares . . . . %s'            % (ChannelTare   ))
   print('          scales  . . . %s'            % (ChannelScale  ))
   print('          offsets . . . %s'            % (ChannelOffset ))
+  print('          oversample  . %s'            % (ChannelOversample))
+  print('          filters . . . %s'            % ([Kind and '%s/%d' % (Kind, Window) for Kind, Window in ChannelFilter]))
+if Devices[0].serial:
+  print('  devices . . . . . . . %s'            % ([Device.serial for Device in Devices]))
 print('  input count . . . . . %d'              % (InputCount    ))
-print('  loop delay  . . . . . %d milliseconds' % (LoopDelay     ))
+if StreamRate:
+  print('  stream rate . . . . . %g scans/second' % (StreamRate    ))
+else:
+  print('  loop delay  . . . . . %d milliseconds' % (LoopDelay     ))
+  print('  overrun policy  . . . %s'              % (OverrunPolicy ))
 print('  loop count  . . . . . %d'              % (LoopCount     ))
+if Decimation > 1:
+  print('  decimation  . . . . . 1 in %d'         % (Decimation    ))
 print('  output file . . . . . %s'              % (OutputFileName))
 
+#==============================================================================
+# calibration is resolved once per device, at startup, into a gain and a bias
+# for each of its inputs, which fold together the u3's own calibration
+# (high-voltage for the first four inputs of an hv model, and low-voltage
+# otherwise) with the config's tare, scale and offset:
+#
+#   ((bits * slope + offset) - tare) * scale + offset'
+#     = bits * (slope * scale) + ((offset - tare) * scale + offset')
+#
+# so that a raw reading becomes a final value with one multiply and one add,
+# done for a whole batch of scans at once when numpy is available.  being
+# linear, it applies as well to the mean of an input's oversampled
+# conversions, which are averaged first.
+#==============================================================================
+
+def ResolveCalibration(Device, isHV):
+  Cal = Device.labjack.calData
+  Gain = []
+  Bias = []
+  for Input in range(Device.count):
+    Channel = Device.first + Input
+    if isHV and Input < 4:
+      if Cal:
+        Slope, Offset = Cal['hvAIN%dSlope' % (Input)], Cal['hvAIN%dOffset' % (Input)]
+      else:
+        Slope, Offset = 0.000314, -10.3 # nominal
+    else:
+      if Cal:
+        Slope, Offset = Cal['lvSESlope'], Cal['lvSEOffset']
+      else:
+        Slope, Offset = 0.000037231, 0.0 # nominal
+    Gain.append(Slope * ChannelScale[Channel])
+    Bias.append((Offset - ChannelTare[Channel]) * ChannelScale[Channel] + ChannelOffset[Channel])
+  if np:
+    Gain = np.array(Gain)
+    Bias = np.array(Bias)
+  Device.gain = Gain
+  Device.bias = Bias
+
+def Calibrate(Device, Raw):
+  """converts a device's raw readings, its oversampled conversions of each
+  input in turn to a scan, into a list of scans of calibrated, scaled values"""
+  if np:
+    Scans = np.asarray(Raw, dtype=float).reshape(-1, Device.width)
+    if Device.width > Device.count:
+      Starts = np.cumsum([0] + Device.oversample[:-1])
+      Scans = np.add.reduceat(Scans, Starts, axis=1) / Device.oversample
+    return (Scans * Device.gain + Device.bias).tolist()
+  Rows = []
+  for Index in range(0, len(Raw), Device.width):
+    Row = []
+    for Input, Oversample in enumerate(Device.oversample):
+      Row.append(sum(Raw[Index:Index + Oversample]) / Oversample * Device.gain[Input] + Device.bias[Input])
+      Index += Oversample
+    Rows.append(Row)
+  return Rows
+
+#==============================================================================
+# acquisition runs in a thread of its own for each device, and pushes raw
+# readings into the device's ring buffer, allocated once up front, with times
+# on the monotonic clock from Start, which all devices share.  the main thread
+# drains them to calibrate, record and display.  so the display, at most
+# DisplayRate times a second whatever the sample rate, and the record keeping
+# never steal time from sampling.  should the consumer fall a whole buffer
+# behind, the oldest scans are overwritten, and counted as overrun.
+#==============================================================================
+
+DisplayRate = 10 # per second
+
+class RingBuffer:
+  def __init__(self, capacity, width):
+    self.capacity = capacity
+    self.width = width
+    if np:
+      self.times = np.zeros(capacity)
+      self.rows = np.zeros((capacity, width))
+    else:
+      self.times = [0.0] * capacity
+      self.rows = [[0] * width for index in range(capacity)]
+    self.head = 0 # scans pushed
+    self.tail = 0 # scans drained
+    self.overrun = 0
+    self.lock = threading.Lock()
+
+  def push(self, times, raw):
+    """adds scans, given their times and their raw readings end to end"""
+    with self.lock:
+      if np:
+        slots = np.arange(self.head, self.head + len(times)) % self.capacity
+        self.times[slots] = times
+        self.rows[slots] = np.asarray(raw).reshape(-1, self.width)
+      else:
+        for index, stamp in enumerate(times):
+          slot = (self.head + index) % self.capacity
+          self.times[slot] = stamp
+          self.rows[slot][:] = raw[index * self.width:(index + 1) * self.width]
+      self.head += len(times)
+
+  def drain(self):
+    """returns the times and raw readings, end to end, of the scans pushed
+    since the last drain"""
+    with self.lock:
+      if self.head - self.tail > self.capacity:
+        self.overrun += self.head - self.tail - self.capacity
+        self.tail = self.head - self.capacity
+      if np:
+        slots = np.arange(self.tail, self.head) % self.capacity
+        times, raw = self.times[slots], self.rows[slots].ravel()
+      else:
+        slots = [slot % self.capacity for slot in range(self.tail, self.head)]
+        times = [self.times[slot] for slot in slots]
+        raw = [value for slot in slots for value in self.rows[slot]]
+      self.tail = self.head
+    return times, raw
+
+Start = None
+Stop = threading.Event()
+Failures = []
+
+def Acquire(Target, Device):
+  try:
+    Target(Device)
+  except Exception as Error:
+    Failures.append((Device, Error)) # reported by the main thread
+    Stop.set() # and the other devices stop too, so the dataset ends together
+
+#==============================================================================
+# acquire by polling: one feedback command per scan, paced by the host.  each
+# scan has a deadline on the shared monotonic clock, the same for every
+# device, and is stamped with the time it was actually taken, and how late
+# that was is kept for the timing report.  when a scan runs past the next
+# deadline, the overrun policy decides what follows (see the -h help
+# information).
+#==============================================================================
+
+def PollInputs(Device):
+  Deadline = Start
+  for Loop in range(LoopCount):
+    Delay = Deadline - time.monotonic()
+    if Delay > 0.0:
+      Stop.wait(Delay)
+    if Stop.is_set():
+      break
+    Taken = time.monotonic()
+    results = Device.labjack.getFeedback(Device.feedback)
+    Device.ring.push([Taken - Start], results[2:2 + Device.width])
+    Late = Taken - Deadline
+    Device.lateness.append(Late)
+    Deadline += LoopDelay
+    Behind = time.monotonic() - Deadline
+    if Behind > 0.0:
+      if OverrunPolicy == 'skip':
+        Missed = int(Behind / LoopDelay) + 1
+        Device.missed += Missed
+        Deadline += Missed * LoopDelay
+      elif OverrunPolicy == 'stretch':
+        Device.missed += 1
+        Deadline += Behind
+    if OverrunPolicy == 'catchup' and Late >= LoopDelay:
+      Device.missed += 1
+
+#==============================================================================
+# summarize the timing of a device's polled run, as percentiles of lateness,
+# nearest rank, in milliseconds
+#==============================================================================
+
+def TimingReport(Device):
+  Sorted = sorted(Device.lateness)
+  Report = {
+    'serial': Device.labjack.serialNumber,
+    'scans' : len(Sorted),
+    'missed': Device.missed,
+  }
+  if Sorted:
+    Jitter = {'mean': sum(Sorted) / len(Sorted) * 1000.0}
+    for Name, Percent in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)):
+      Rank = max(1, -(-len(Sorted) * Percent // 100))
+      Jitter[Name] = Sorted[Rank - 1] * 1000.0
+    Report['jitter_ms'] = Jitter
+  return Report
+
+#==============================================================================
+# acquire in stream mode, where the u3 paces the scans and sends them back in
+# packets.  each packet holds a run of samples, which continues the scan in
+# progress from the packet before, then how many bytes remain in the u3's
+# stream buffer, the backlog, which grows if the host can't keep up and, once
+# the buffer overflows, samples are missed.  missed samples are counted, and
+# skipped over in time and in their place in the scan, so later scans keep
+# their true times and inputs.  scan times count from the moment the stream
+# started, on the shared clock.
+#==============================================================================
+
+def SplitPackets(Raw, PacketSize):
+  """returns the samples and the largest backlog in a run of stream packets"""
+  Raw = bytes(Raw)
+  if np:
+    Packets = np.frombuffer(Raw, dtype=np.uint8).reshape(-1, PacketSize)
+    Samples = Packets[:, 12:12 + 2 * StreamPacket].copy().view('<u2').ravel()
+    return Samples, int(Packets[:, 12 + 2 * StreamPacket].max(initial=0))
+  Samples = []
+  Backlog = 0
+  for Offset in range(0, len(Raw) - PacketSize + 1, PacketSize):
+    Samples += struct.unpack_from('<%dH' % (StreamPacket), Raw, Offset + 12)
+    Backlog = max(Backlog, Raw[Offset + 12 + 2 * StreamPacket])
+  return Samples, Backlog
+
+def StreamInputs(Device):
+  LabJack = Device.labjack
+  InputCount = Device.width # samples to a scan
+  PChannels = [Input for Input, Oversample in enumerate(Device.oversample) for Conversion in range(Oversample)]
+  LabJack.streamConfig(NumChannels=InputCount, PChannels=PChannels,
+    NChannels=[31] * InputCount, Resolution=StreamResolution,
+    SamplesPerPacket=StreamPacket, ScanFrequency=StreamRate)
+  PacketSize = 14 + 2 * StreamPacket
+  Position = 0 # in the stream of the first sample not yet used, counting those missed
+  Carry = []   # samples of a scan continued in the next packet
+  Acquired = 0
+  LabJack.streamStart()
+  Started = time.monotonic() - Start
+  try:
+    for Result in LabJack.streamData(convert=False):
+      if Stop.is_set():
+        break
+      if Result is None:
+        continue # nothing arrived in time
+      Device.stream['errors'] += Result['errors']
+      if Result['missed']:
+        Device.stream['missed'] += Result['missed']
+        Position += len(Carry) + Result['missed']
+        Carry = []
+      Samples, Backlog = SplitPackets(Result['result'], PacketSize)
+      Device.stream['backlog'] = max(Device.stream['backlog'], Backlog)
+      Skip = -Position % InputCount # back in step with the scan
+      Position += Skip
+      if np:
+        Samples = np.concatenate((Carry, Samples[Skip:]))
+      else:
+        Samples = Carry + Samples[Skip:]
+      Scans = min(len(Samples) // InputCount, LoopCount - Acquired)
+      Whole = Scans * InputCount
+      Carry = Samples[Whole:]
+      First = Position // InputCount
+      Device.ring.push([Started + (First + Scan) / StreamRate for Scan in range(Scans)], Samples[:Whole])
+      Position += Whole
+      Acquired += Scans
+      if Acquired >= LoopCount:
+        break
+  finally:
+    LabJack.streamStop()
+
+#==============================================================================
+# drain the ring buffers: calibrate, filter, record one scan in Decimation,
+# and show the latest scans if it is time to.  returns the time they were
+# last shown.
+#==============================================================================
+
+def Consume(Shown):
+  Fresh = False
+  for Device in Devices:
+    Times, Raw = Device.ring.drain()
+    if not len(Times):
+      continue
+    Rows = Calibrate(Device, Raw)
+    if any(Device.filters):
+      for Row in Rows:
+        for Input, Filter in enumerate(Device.filters):
+          if Filter:
+            Row[Input] = Filter.update(Row[Input])
+    if OutputFileName:
+      Kept = range(Decimation - 1 - Device.scans % Decimation, len(Rows), Decimation)
+      Device.times += [float(Times[Index]) for Index in Kept]
+      Device.rows += [Rows[Index] for Index in Kept]
+    Device.scans += len(Rows)
+    Device.latest = (float(Times[-1]), Rows[-1])
+    Fresh = True
+  if Fresh and time.time() - Shown >= 1.0 / DisplayRate:
+    Shown = time.time()
+    Summary = ''
+    for Device in Devices:
+      if Device.latest:
+        for Value in Device.latest[1]:
+          Summary += '%8.3f  ' % (Value)
+      else:
+        Summary += '%8s  ' % ('-') * Device.count
+    Latest = max(Device.latest[0] for Device in Devices if Device.latest)
+    print('   %06.2f  %s' % (Latest, Summary), end='\r')
+  return Shown
+
+#==============================================================================
+# merge the devices' scans into one dataset, in time order.  each sample set
+# holds the latest scan from every device, once every device has one, so that
+# it has a value for every channel, and, when there are several devices, the
+# times those scans were taken, device by device.
+#==============================================================================
+
+def MergeScans():
+  Latest = [None] * len(Devices)
+  Taken = [None] * len(Devices)
+  Scans = [zip(Device.times, itertools.repeat(Index), Device.rows) for Index, Device in enumerate(Devices)]
+  Merged = []
+  for Time, Index, Row in heapq.merge(*Scans, key=lambda Scan: Scan[0]):
+    Latest[Index] = Row
+    Taken[Index] = Time
+    if None in Latest:
+      continue
+    Set = {'time': Time, 'values': [Value for Values in Latest for Value in Values]}
+    if len(Devices) > 1:
+      Set['times'] = list(Taken)
+    Merged.append(Set)
+  return Merged
+
+#==============================================================================
+# open a device, by serial number if it has one, and set it up to read its
+# inputs.  a device that cannot be opened raises MissingDevice, so that it
+# can be told apart from anything that goes wrong once it is open.
+#==============================================================================
+
+QuickSample = 1
+LongSettling = 0
+
+class MissingDevice(Exception):
+  pass
+
+def OpenDevice(Device):
+  try:
+    if Device.serial:
+      LabJack = u3.U3(firstFound=False, serial=Device.serial)
+    else:
+      LabJack = u3.U3()
+  except Exception:
+    raise MissingDevice(Device)
+  Device.labjack = LabJack
+  LabJack.getCalibrationData()
+  FIOEIOAnalog = (2 ** Device.count) - 1
+  fios = FIOEIOAnalog & 0xFF
+  eios = FIOEIOAnalog // 256
+  LabJack.configIO(FIOAnalog=fios, EIOAnalog=eios)
+  LabJack.getFeedback(u3.PortDirWrite(Direction=[0, 0, 0], WriteMask=[0, 0, 15]))
+  Device.feedback = []
+  Device.feedback.append(u3.DAC0_8(Value=125))
+  Device.feedback.append(u3.PortStateRead())
+  if LabJack.configU3()['VersionInfo'] & 18 == 18:
+    isHV = True # U3 is an HV
+  else:
+    isHV = False
+  for Input, Oversample in enumerate(Device.oversample):
+    for Conversion in range(Oversample):
+      Device.feedback.append(u3.AIN(Input, 31, QuickSample=QuickSample, LongSettling=LongSettling))
+  ResolveCalibration(Device, isHV)
+
 #==============================================================================
 # do the actual sampling
 #==============================================================================
 
 print()
 LoopDelay = float(LoopDelay) / 1000.0
-QuickSample = 1
-LongSettling = 0
-InputSet = []
+Timing = None
+Failed = False
 try:
-  LabJack = u3.U3()
-  LabJack.getCalibrationData()
   try:
-    FIOEIOAnalog = (2 ** InputCount) - 1
-    fios = FIOEIOAnalog & 0xFF
-    eios = FIOEIOAnalog // 256
-    LabJack.configIO(FIOAnalog=fios, EIOAnalog=eios)
-    LabJack.getFeedback(u3.PortDirWrite(Direction=[0, 0, 0], WriteMask=[0, 0, 15]))
-    FeedbackArguments = []
-    FeedbackArguments.append(u3.DAC0_8(Value=125))
-    FeedbackArguments.append(u3.PortStateRead())
-    if LabJack.configU3()['VersionInfo'] & 18 == 18:
-      isHV = True # U3 is an HV
-    else:
-      isHV = False
-    for Input in range(InputCount):
-      FeedbackArguments.append(u3.AIN(Input, 31, QuickSample=QuickSample, LongSettling=LongSettling))
-    Time0 = time.time()
-    Time1 = Time0
+    for Device in Devices:
+      OpenDevice(Device)
     Path(SemaphoreFileName).touch()
     print('     time', end='')
     for Input in range(InputCount):
@@ -289,49 +872,88 @@ try:
     for Input in range(InputCount):
       print('%10s' % ('-' * 8), end='')
     print()
-    for Loop in range(LoopCount):
-      results = LabJack.getFeedback(FeedbackArguments)
-      Summary = ''
-      InputValues = []
-      for Input in range(InputCount):
-        if isHV is True and Input < 4:
-          lowVoltage = False # use high voltage calibration
-        else:
-          lowVoltage = True
-        Value = LabJack.binaryToCalibratedAnalogVoltage(results[2 + Input], isLowVoltage=lowVoltage, isSingleEnded=True)
-        Value -= ChannelTare  [Input]
-        Value *= ChannelScale [Input]
-        Value += ChannelOffset[Input]
-        InputValues.append(Value)
-        #DisplayValues[Input] *=    9.0 / 10.0
-        #DisplayValues[Input] +=  Value / 10.0
-        #Display = DisplayValues[Input] / 10.0 # smoothing
-        #Summary += '%8.3f  ' % (Display)
-        Summary += '%8.3f  ' % (Value)
-      Time = time.time() - Time0
-      if OutputFileName:
-        InputSet.append({'time': Time, 'values': InputValues})
-      print('   %06.2f  %s' % (Time, Summary), end='\r')
-      Time2 = time.time()
-      Delay = LoopDelay - (Time2 - Time1)
-      time.sleep(Delay)
-      Time1 += LoopDelay
+    Acquirers = []
+    for Device in Devices:
+      if StreamRate:
+        Device.ring = RingBuffer(max(1024, int(StreamRate * 2)), Device.width)
+        Target = StreamInputs
+      else:
+        Device.ring = RingBuffer(max(1024, int(2 / LoopDelay)), Device.width)
+        Target = PollInputs
+      Acquirers.append(threading.Thread(target=Acquire, args=(Target, Device), daemon=True))
+    Start = time.monotonic()
+    for Acquirer in Acquirers:
+      Acquirer.start()
+    Shown = 0.0
+    try:
+      while True:
+        Alive = [Acquirer for Acquirer in Acquirers if Acquirer.is_alive()]
+        if not Alive:
+          break
+        Alive[0].join(1.0 / DisplayRate)
+        Shown = Consume(Shown)
+    finally:
+      Stop.set()
+      for Acquirer in Acquirers:
+        Acquirer.join()
+      Consume(0.0)
+      print()
+    for Device, Error in Failures:
+      print()
+      print('*** acquisition from the u3 with serial number %d stopped early: %s' % (Device.labjack.serialNumber, Error))
+    if not StreamRate:
+      Timing = {
+        'policy'  : OverrunPolicy,
+        'delay_ms': LoopDelay * 1000.0,
+        'devices' : [],
+      }
     print()
+    for Device in Devices:
+      if len(Devices) > 1:
+        Label = ' %d' % (Device.labjack.serialNumber)
+      else:
+        Label = ''
+      if StreamRate:
+        print('  stream%s: %d scans at %g per second, %d samples missed, %d packet errors, backlog up to %d bytes' % (
+          Label, Device.ring.head, StreamRate, Device.stream['missed'], Device.stream['errors'], Device.stream['backlog']
+        ))
+      else:
+        Report = TimingReport(Device)
+        Timing['devices'].append(Report)
+        print('  timing%s: %d scans, %d deadlines missed (%s)' % (Label, Report['scans'], Report['missed'], OverrunPolicy), end='')
+        if 'jitter_ms' in Report:
+          print(', jitter mean %(mean).3f p50 %(p50).3f p90 %(p90).3f p99 %(p99).3f max %(max).3f ms' % (Report['jitter_ms']), end='')
+        print()
+    Overrun = sum(Device.ring.overrun for Device in Devices)
+    if Overrun:
+      print()
+      print('*** %d scans were overwritten before they could be recorded' % (Overrun))
   finally:
-    LabJack.close()
+    for Device in Devices:
+      if Device.labjack:
+        Device.labjack.close()
 except KeyboardInterrupt:
   print()
   pass
-except:
-  print("*** couldn't find a labjack u3 device - is one plugged in and turned on?")
+except MissingDevice as Error:
+  Missing = Error.args[0]
+  if Missing.serial:
+    print("*** couldn't find the labjack u3 with serial number %d - is it plugged in and turned on?" % (Missing.serial))
+  else:
+    print("*** couldn't find a labjack u3 device - is one plugged in and turned on?")
   print()
   os._exit(1)
+except Exception as Error:
+  print()
+  print('*** acquisition stopped by an error: %s: %s' % (type(Error).__name__, Error))
+  Failed = True
 
 if OutputFileName:
   with open(OutputFileName, 'w') as f:
     Channels = []
     for Input in range(InputCount):
       Channels.append(ChannelName[Input])
+    InputSet = MergeScans()
     DataSet = {
       'channels': Channels,
       'data'    : InputSet
@@ -340,7 +962,14 @@ if OutputFileName:
 
   print()
   print('done - wrote %d sample sets to %s' % (len(InputSet), OutputFileName))
+  if Timing:
+    TimingFileName = '%s-timing.json' % (os.path.splitext(OutputFileName)[0])
+    with open(TimingFileName, 'w') as f:
+      f.write(json.dumps(Timing, indent=2))
+    print('     and the timing report to %s' % (TimingFileName))
 print()
+if Failed:
+  os._exit(1)
 
 #==============================================================================
 # end
@@ -0,0 +1,39 @@
+#!/bin/bash
+
+# pv and battery simulation from a single at-rd6000 process, so that both
+# supplies start together and share one timebase
+
+VARS='test-vars.sh'
+
+if [ -f "${VARS}" ]; then
+  while true; do
+    unset R5 VBAT
+    source test-vars.sh
+
+    ../at-rd6000.py -o=${R5}-${VBAT}-rd-both.json -s=${START_FLAG} \
+      -i=18927 \
+        v=0 \
+        ocp=0.35 \
+        on \
+        s=1 \
+        v=10 \
+        s=38 \
+        v=0 \
+        off \
+      -i=19103 \
+        v=${VBAT} \
+        ocp=0.65 \
+        on \
+        [v+0.01,m=15]=150 \
+        [v-0.01,m=15]=150 \
+        v=0 \
+        off
+
+    rm -f ${START_FLAG}
+    while [ ! -f ${END_FLAG} ]; do
+      sleep 0.2
+    done
+  done
+else
+  echo "*** vars file '${VARS}' not found - run ./test.sh to configure!"
+fi